@@ -0,0 +1,441 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import sceneElements as SE
+
+#Parts of a frame timed separately by the scaling suite
+frameStages = ["smoke", "movement", "lights", "objects", "composite"]
+
+#Default scene the scaling suite changes one thing about at a time
+baseScene = {
+    "resolution" : (512, 288),
+    "lights" : 8,
+    "smokeStrength" : 50,
+    "objects" : 2
+}
+
+#Values tried for each thing the scaling suite changes
+suiteAxes = {
+    "resolution" : [(512, 288), (1280, 720), (1920, 1080), (3840, 2160)],
+    "lights" : [1, 4, 16, 64],
+    "smokeStrength" : [0, 50, 200, 1000],
+    "objects" : [0, 2, 8, 32]
+}
+
+#Instructions that move between two sets of values and back forever, as columns like a choreography sheet
+def getSweepInstructions(valueNames, startValues, endValues, period):
+    instructionSet = {
+        "Instruction" : ["Move To", "Move To", "Loop To"],
+        "End Time" : [period / 2, period, None],
+        "Loop To Index" : [None, None, 0]
+    }
+    for valueName, startValue, endValue in zip(valueNames, startValues, endValues):
+        instructionSet[valueName] = [endValue, startValue, None]
+    return instructionSet
+
+#Build a stage through the Scene api where every light, smoke machine and object keeps moving
+#The same seed always gives the same stage
+def makeSyntheticScene(horizontalSize, verticalSize, lightCount = 8, smokeStrength = 50, objectCount = 2, seed = 0, **sceneOptions):
+    random = np.random.RandomState(seed)
+    stage = SE.Scene(horizontalSize, verticalSize, 0.1, **sceneOptions)
+    stage.setBackground("backdrop.png")
+
+    colors = ["white", "red", "green", "blue", "yellow", "cyan", "magenta"]
+    for i in range(lightCount):
+        direction = random.uniform(-150, -30)
+        spreadAngle = random.uniform(5, 40)
+        instructionSet = getSweepInstructions(["Direction", "Spread Angle"], [direction, spreadAngle], [direction + random.uniform(-30, 30), spreadAngle / 2], random.uniform(2, 6))
+        stage.addLight(random.uniform(0, horizontalSize), direction, 5, spreadAngle, random.choice([1, 1, 1, 20]), colors[i % len(colors)], instructionSet)
+
+    #Strength is split between two machines at either side of the stage
+    if smokeStrength > 0:
+        for xPosition, direction in [(0.2, 60), (0.8, 120)]:
+            instructionSet = getSweepInstructions(["Direction"], [direction], [180 - direction], 4)
+            stage.addSmokeMachine([horizontalSize * xPosition, verticalSize * 0.1], smokeStrength / 2, direction, 150, instructionSet)
+
+    images = ["drum.png", "guitar.png"]
+    for i in range(objectCount):
+        horizontalPosition = random.uniform(0, horizontalSize * 0.8)
+        verticalPosition = random.uniform(0, verticalSize * 0.5)
+        instructionSet = getSweepInstructions(["Horizontal Position"], [horizontalPosition], [horizontalPosition + horizontalSize * 0.1], random.uniform(2, 6))
+        stage.addObject(images[i % len(images)], 0, [horizontalPosition, verticalPosition], horizontalSize // 8, instructionSet)
+
+    return stage
+
+#Run the stage for a number of frames, timing each part of the frame separately
+#Follows the same steps as Scene.render, returns the total seconds spent in each part
+def timeFrameStages(stage, frames, dt):
+    stageTimes = {stageName : 0.0 for stageName in frameStages}
+
+    for i in range(frames):
+        startTime = time.perf_counter()
+        stage.smoke.updateSmokeScreen(dt)
+        smokeTime = time.perf_counter()
+
+        for light in stage.lightList:
+            light.update(dt)
+        for object in stage.objectList:
+            object.update(dt)
+        movementTime = time.perf_counter()
+
+        lightScreen = stage.getLightScreen()
+        lightsTime = time.perf_counter()
+
+        backdrop = stage.getBackdrop()
+        objectsTime = time.perf_counter()
+
+        stage.combineScreens(lightScreen, backdrop)
+        compositeTime = time.perf_counter()
+
+        stageTimes["smoke"] += smokeTime - startTime
+        stageTimes["movement"] += movementTime - smokeTime
+        stageTimes["lights"] += lightsTime - movementTime
+        stageTimes["objects"] += objectsTime - lightsTime
+        stageTimes["composite"] += compositeTime - objectsTime
+
+    return stageTimes
+
+#Time one synthetic scene, returning a flat record that can be written as a row of a csv file
+#Scene memory is what the stage holds once it is running, peak frame memory is the most allocated at once while drawing a frame
+def benchmarkScene(horizontalSize, verticalSize, lightCount, smokeStrength, objectCount, frames = 20, warmupFrames = 30, dt = 1 / 30, **sceneOptions):
+    np.random.seed(0)
+    tracemalloc.start()
+    stage = makeSyntheticScene(horizontalSize, verticalSize, lightCount, smokeStrength, objectCount, **sceneOptions)
+
+    #Let the smoke build up before timing
+    timeFrameStages(stage, warmupFrames, dt)
+    sceneBytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    timeFrameStages(stage, 1, dt)
+    peakFrameBytes = tracemalloc.get_traced_memory()[1] - sceneBytes
+    tracemalloc.stop()
+
+    stageTimes = timeFrameStages(stage, frames, dt)
+    frameTime = sum(stageTimes.values()) / frames
+
+    record = {
+        "horizontalSize" : horizontalSize,
+        "verticalSize" : verticalSize,
+        "lights" : lightCount,
+        "smokeStrength" : smokeStrength,
+        "objects" : objectCount,
+        "smokeEngine" : type(stage.smoke).__name__,
+        "compositeMode" : stage.compositeMode,
+        "smokeScale" : stage.smoke.smokeScale,
+        "particles" : stage.smoke.particles.count if hasattr(stage.smoke, "particles") else 0,
+        "frames" : frames
+    }
+    for stageName in frameStages:
+        record[stageName + "Ms"] = stageTimes[stageName] / frames * 1000
+    record["frameMs"] = frameTime * 1000
+    record["fps"] = 1 / frameTime
+    record["sceneBytes"] = sceneBytes
+    record["peakFrameBytes"] = peakFrameBytes
+    return record
+
+#Change one thing about the base scene at a time, giving a scaling curve for each
+def runScalingSuite(axes = None, frames = 20, warmupFrames = 30, **sceneOptions):
+    if axes == None:
+        axes = list(suiteAxes)
+    
+    results = []
+    print("axis".ljust(14) + "value".rjust(12) + "".join(stageName.rjust(11) for stageName in frameStages) + "frame ms".rjust(11) + "fps".rjust(8) + "peak MB".rjust(9))
+    for axis in axes:
+        for value in suiteAxes[axis]:
+            scene = dict(baseScene)
+            scene[axis] = value
+            horizontalSize, verticalSize = scene["resolution"]
+
+            record = benchmarkScene(horizontalSize, verticalSize, scene["lights"], scene["smokeStrength"], scene["objects"], frames, warmupFrames, **sceneOptions)
+            record = dict({"axis" : axis}, **record)
+            results.append(record)
+
+            valueName = str(horizontalSize) + "x" + str(verticalSize) if axis == "resolution" else str(value)
+            print(axis.ljust(14) + valueName.rjust(12) + "".join(("%.2f" % record[stageName + "Ms"]).rjust(11) for stageName in frameStages) + ("%.2f" % record["frameMs"]).rjust(11) + ("%.1f" % record["fps"]).rjust(8) + ("%.1f" % (record["peakFrameBytes"] / 2 ** 20)).rjust(9))
+    
+    return results
+
+#Save suite results as json with details of the machine, or as csv with one row per scene
+def saveResults(results, outputLocation):
+    if os.path.splitext(outputLocation)[1].lower() == ".csv":
+        with open(outputLocation, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        machine = {
+            "python" : platform.python_version(),
+            "numpy" : np.__version__,
+            "processor" : platform.processor(),
+            "cpuCount" : os.cpu_count(),
+            "time" : time.strftime("%Y-%m-%dT%H:%M:%S")
+        }
+        with open(outputLocation, "w") as file:
+            json.dump({"machine" : machine, "results" : results}, file, indent=4)
+
+#Compares how long each smoke engine takes per frame as the smoke machines get stronger
+def benchmarkSmokeEngines(horizontalSize, verticalSize, strengths, frames, dt):
+    results = []
+
+    for smokeEngine in ["particle", "grid"]:
+        for strength in strengths:
+            np.random.seed(0)
+            stage = SE.Scene(horizontalSize, verticalSize, 0.1, smokeEngine)
+            stage.addSmokeMachine([horizontalSize * 0.25, verticalSize * 0.2], strength, 45, 200, None)
+            stage.addSmokeMachine([horizontalSize * 0.75, verticalSize * 0.2], strength, 135, 200, None)
+            for smokeMachine in stage.smoke.smokeMachines:
+                smokeMachine.halted = True
+
+            startTime = time.perf_counter()
+            for i in range(frames):
+                stage.smoke.updateSmokeScreen(dt)
+            frameTime = (time.perf_counter() - startTime) / frames
+
+            results.append({
+                "engine" : smokeEngine,
+                "strength" : strength,
+                "particles" : stage.smoke.particles.count,
+                "frameTime" : frameTime
+            })
+            print(smokeEngine.ljust(10) + str(strength).rjust(8) + str(stage.smoke.particles.count).rjust(10) + ("%.2f" % (frameTime * 1000)).rjust(12) + " ms")
+
+    return results
+
+#Compares drawing lights one at a time with drawing them all at once as the number of lights grows
+#Every light moves every frame so nothing can be reused from the previous frame
+def benchmarkLightRasterizers(horizontalSize, verticalSize, lightCounts, frames):
+    results = []
+
+    for batchLights in [False, True]:
+        for lightCount in lightCounts:
+            np.random.seed(0)
+            stage = SE.Scene(horizontalSize, verticalSize, 0.1, batchLights = batchLights)
+            for i in range(lightCount):
+                stage.addLight(np.random.uniform(0, horizontalSize), np.random.uniform(-170, -10), 11, np.random.uniform(0, 60), 2, "white", None)
+
+            startTime = time.perf_counter()
+            for i in range(frames):
+                for light in stage.lightList:
+                    light.setDirection(np.random.uniform(-170, -10))
+
+                if batchLights:
+                    stage.lightRasterizer.getLightScreen(stage.lightList)
+                else:
+                    lightScreen = np.zeros([horizontalSize, verticalSize, 3])
+                    for light in stage.lightList:
+                        light.addLightToScreen(lightScreen)
+            frameTime = (time.perf_counter() - startTime) / frames
+
+            rasterizer = "batched" if batchLights else "per light"
+            results.append({
+                "rasterizer" : rasterizer,
+                "lights" : lightCount,
+                "frameTime" : frameTime
+            })
+            print(rasterizer.ljust(10) + str(lightCount).rjust(8) + ("%.2f" % (frameTime * 1000)).rjust(12) + " ms")
+
+    return results
+
+#Compares the float64 compositing with the float32 compositing that draws into buffers kept by the scene
+#Allocated memory is the total size of every array made while drawing a frame, all of which has to be written then read again
+def benchmarkCompositing(horizontalSize, verticalSize, frames):
+    results = []
+
+    for compositeMode in ["float64", "float32"]:
+        np.random.seed(0)
+        stage = SE.Scene(horizontalSize, verticalSize, 0.1, compositeMode = compositeMode)
+        stage.setBackground("backdrop.png")
+        for i in range(8):
+            stage.addLight(np.random.uniform(0, horizontalSize), np.random.uniform(-170, -10), 5, np.random.uniform(0, 60), 2, "white", None)
+        stage.addObject("drum.png", 0, [horizontalSize * 0.4, 5], horizontalSize // 4, None)
+        stage.addObject("guitar.png", 1, [horizontalSize * 0.7, 5], horizontalSize // 10, None)
+        stage.update(1 / 30)
+        stage.composite()
+
+        #Nothing moves between the timed frames, so the scene would otherwise reuse the first one
+        stage.reuseLayers = False
+        startTime = time.perf_counter()
+        for i in range(frames):
+            stage.composite()
+        frameTime = (time.perf_counter() - startTime) / frames
+
+        tracemalloc.start()
+        stage.composite()
+        allocatedBytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results.append({
+            "compositeMode" : compositeMode,
+            "frameTime" : frameTime,
+            "fps" : 1 / frameTime,
+            "allocatedBytes" : allocatedBytes
+        })
+        print(compositeMode.ljust(10) + ("%.2f" % (frameTime * 1000)).rjust(10) + " ms" + ("%.1f" % (1 / frameTime)).rjust(8) + " fps" + ("%.1f" % (allocatedBytes / 2 ** 20)).rjust(10) + " MB allocated per frame")
+
+    return results
+
+#Compares the float32 compositing with the tiled compositing on a stage lit by a few narrow beams, where most of the screen is dark
+#Each tiled row is a tile size and number of threads, with the share of tiles that were skipped
+def benchmarkTiles(horizontalSize, verticalSize, tileSizes, workerCounts, frames, beamCount = 4, dt = 1 / 30):
+    results = []
+    options = [{"compositeMode" : "float32"}]
+    options += [{"compositeMode" : "tiled", "tileSize" : tileSize, "tileWorkers" : workers} for tileSize in tileSizes for workers in workerCounts]
+
+    for sceneOptions in options:
+        random = np.random.RandomState(0)
+        stage = SE.Scene(horizontalSize, verticalSize, 0.1, **sceneOptions)
+        stage.setBackground("backdrop.png")
+        for i in range(beamCount):
+            direction = random.uniform(-120, -60)
+            instructionSet = getSweepInstructions(["Direction"], [direction], [direction + random.uniform(-20, 20)], random.uniform(2, 6))
+            stage.addLight(random.uniform(horizontalSize * 0.2, horizontalSize * 0.8), direction, 5, random.uniform(2, 6), 2, "white", instructionSet)
+        stage.addObject("drum.png", 0, [horizontalSize * 0.4, 5], horizontalSize // 4, None)
+        stage.update(0)
+        stage.composite()
+
+        frameTime = 0.0
+        for i in range(frames):
+            stage.update(dt)
+            startTime = time.perf_counter()
+            stage.composite()
+            frameTime += time.perf_counter() - startTime
+        frameTime /= frames
+
+        result = dict(sceneOptions)
+        result["frameTime"] = frameTime
+        result["fps"] = 1 / frameTime
+        name = "float32"
+        if stage.tiledCompositor != None:
+            stats = stage.tiledCompositor.getStats()
+            result["skippedFraction"] = stats["skippedFraction"]
+            name = str(sceneOptions["tileSize"]) + "px x" + str(sceneOptions["tileWorkers"])
+        results.append(result)
+
+        line = name.ljust(10) + ("%.2f" % (frameTime * 1000)).rjust(10) + " ms" + ("%.1f" % (1 / frameTime)).rjust(8) + " fps"
+        if "skippedFraction" in result:
+            line += ("%.0f" % (100 * result["skippedFraction"])).rjust(8) + "% of tiles skipped"
+        print(line)
+
+    return results
+
+#Compare drawing frames on one thread with the render pipeline on different numbers of threads
+#displayTime is slept after every frame like a window or video encoder would take, the pipeline simulates the next frame's smoke during it
+def benchmarkPipeline(horizontalSize, verticalSize, workerCounts, frames, displayTime = 0.0, dt = 1 / 30):
+    import renderPipeline
+    results = []
+
+    for workers in [0] + workerCounts:
+        stage = makeSyntheticScene(horizontalSize, verticalSize, smokeStrength = 200)
+        if workers > 0:
+            stage.setPipeline(renderPipeline.RenderPipeline(stage, workers))
+        for i in range(30):
+            stage.render(dt)
+
+        startTime = time.perf_counter()
+        for i in range(frames):
+            stage.render(dt)
+            if displayTime > 0:
+                time.sleep(displayTime)
+        frameTime = (time.perf_counter() - startTime) / frames
+
+        overlap = stage.pipeline.getStats()["overlap"] if workers > 0 else 1.0
+        stage.setPipeline(None)
+        results.append({
+            "workers" : workers,
+            "frameTime" : frameTime,
+            "fps" : 1 / frameTime,
+            "overlap" : overlap
+        })
+        name = str(workers) + " threads" if workers > 0 else "serial"
+        print(name.ljust(10) + ("%.2f" % (frameTime * 1000)).rjust(10) + " ms" + ("%.1f" % (1 / frameTime)).rjust(8) + " fps" + ("%.2f" % overlap).rjust(8) + "x overlap")
+
+    return results
+
+
+#Time how long a fresh python takes to import everything, load a choreography and draw the first frame
+#Cold starts read the excel workbook and save the cache, warm starts load the cache saved by the cold start
+def benchmarkStartup(choreogrpahyLocation, runs = 3):
+    import stageLoader
+    script = "import time\nstartTime = time.perf_counter()\nimport stageLoader\nstageLoader.loadStage(" + repr(choreogrpahyLocation) + ").render(0)\nprint(time.perf_counter() - startTime)"
+
+    results = []
+    for startType in ["cold", "warm"]:
+        times = []
+        for i in range(runs):
+            cacheLocation = stageLoader.getCacheLocation(choreogrpahyLocation)
+            if startType == "cold" and os.path.isfile(cacheLocation):
+                os.remove(cacheLocation)
+
+            startTime = time.perf_counter()
+            output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+            processTime = time.perf_counter() - startTime
+            times.append((float(output.split()[-1]), processTime))
+
+        loadTime = min(loadTime for loadTime, processTime in times)
+        processTime = min(processTime for loadTime, processTime in times)
+        results.append({
+            "start" : startType,
+            "loadTime" : loadTime,
+            "processTime" : processTime
+        })
+        print(startType.ljust(6) + ("%.2f" % loadTime).rjust(10) + " s to first frame" + ("%.2f" % processTime).rjust(10) + " s including python startup")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the stage simulation")
+    parser.add_argument("size", nargs="*", type=int, default=[512, 288], help="Horizontal and vertical size for the engine comparisons")
+    parser.add_argument("--suite", action="store_true", help="Run the scaling suite on synthetic scenes instead of the engine comparisons")
+    parser.add_argument("--axes", nargs="+", choices=list(suiteAxes), help="Only change these things about the base scene")
+    parser.add_argument("--frames", type=int, default=20, help="Frames timed for each scene")
+    parser.add_argument("--warmup", type=int, default=30, help="Frames run before timing so the smoke can build up")
+    parser.add_argument("--engine", default="particle", help="Smoke engine for the suite")
+    parser.add_argument("--composite", default="float64", help="Composite mode for the suite")
+    parser.add_argument("--tile-size", type=int, default=32, help="Size of the tiles when the suite uses the tiled composite mode")
+    parser.add_argument("--tile-workers", type=int, default=1, help="Threads the tiled composite mode shares lit tiles between in the suite")
+    parser.add_argument("--batch-lights", action="store_true", help="Draw all lights at once in the suite")
+    parser.add_argument("--smoke-scale", type=int, default=1, help="Simulate the smoke this many times smaller than the stage in the suite")
+    parser.add_argument("--output", help="Save the suite results to a .json or .csv file")
+    parser.add_argument("--display-ms", type=float, default=0, help="Time to wait after every frame in the pipeline comparison, like a window showing it")
+    parser.add_argument("--startup", metavar="CHOREOGRAPHY", help="Compare starting with and without a cached choreography instead")
+    arguments = parser.parse_args()
+
+    if arguments.startup != None:
+        benchmarkStartup(arguments.startup)
+
+    elif arguments.suite:
+        results = runScalingSuite(arguments.axes, arguments.frames, arguments.warmup, smokeEngine = arguments.engine, batchLights = arguments.batch_lights, compositeMode = arguments.composite, smokeScale = arguments.smoke_scale, tileSize = arguments.tile_size, tileWorkers = arguments.tile_workers)
+        if arguments.output != None:
+            saveResults(results, arguments.output)
+    
+    else:
+        horizontalSize, verticalSize = arguments.size[:2]
+
+        print("engine    strength particles  frame time")
+        benchmarkSmokeEngines(horizontalSize, verticalSize, [10, 50, 200, 1000], 150, 1 / 30)
+
+        print()
+        print("lights     count  frame time")
+        benchmarkLightRasterizers(horizontalSize, verticalSize, [1, 4, 16, 64], 10)
+
+        print()
+        print("pipeline  frame time (" + str(os.cpu_count()) + " cores)")
+        benchmarkPipeline(horizontalSize, verticalSize, [1, 2, 3], 60, arguments.display_ms / 1000)
+
+        print()
+        print("compositing at 1920x1080")
+        benchmarkCompositing(1920, 1080, 10)
+
+        #Tiling only pays off once the stage is big enough for the skipped tiles to outweigh finding them
+        for tileHorizontalSize, tileVerticalSize in [[512, 288], [1920, 1080], [3840, 2160]]:
+            print()
+            print("tiles     composite time (narrow beams at " + str(tileHorizontalSize) + "x" + str(tileVerticalSize) + ")")
+            benchmarkTiles(tileHorizontalSize, tileVerticalSize, [16, 32, 64], [1, 4], 10)
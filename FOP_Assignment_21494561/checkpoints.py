@@ -0,0 +1,201 @@
+import bisect
+import json
+import os
+import time
+import numpy as np
+import sceneElements as SE
+
+#Changed whenever the layout of saved checkpoints changes so old ones are made again
+checkpointVersion = 1
+
+#Snapshots of a stage taken every few seconds of the show, so any time can be reached by restoring the checkpoint before it and simulating only the rest
+#A checkpoint for frame n is the state just before frame n is simulated, the same as the snapshots parallelRender starts its chunks from
+#Checkpoints are kept in memory, or with a directory as .npy files read straight from the disk when they are restored
+#Arrays that are the same as in the checkpoint before, such as an unchanging velocity screen, are only kept once
+class CheckpointStore:
+    def __init__(self, stage, fps = 30, interval = 5.0, directory = None, key = ""):
+        self.stage = stage
+        self.fps = fps
+        self.dt = 1 / fps
+        self.intervalFrames = max(1, int(round(interval * fps)))
+        self.directory = directory
+        self.key = key                  #Anything that changes the show, eg the hash of the choreography, saved checkpoints with a different key are not used
+
+        self.frames = []                #Frame each checkpoint is for, in order
+        self.checkpoints = []           #Snapshots with their arrays either in memory or replaced by the name of their .npy file
+        self.endFrame = None            #Frame the show ends on, once it has been reached
+        self.arrayFiles = {}            #Arrays already read from the disk, by file name
+        self.storedBytes = 0
+        self.recordTime = 0.0
+        self.lastSeek = {"time" : 0.0, "checkpointFrame" : 0, "simulatedFrames" : 0}
+
+        if directory != None:
+            os.makedirs(directory, exist_ok = True)
+            self.loadIndex()
+
+    def getIndexLocation(self):
+        return os.path.join(self.directory, "index.json")
+
+    #Read checkpoints saved by an earlier run, keeping none of them if the show has changed since
+    def loadIndex(self):
+        try:
+            with open(self.getIndexLocation()) as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return
+
+        if index.get("version") != checkpointVersion or index.get("key") != self.key or index.get("fps") != self.fps or index.get("intervalFrames") != self.intervalFrames:
+            print("Checkpoints in " + self.directory + " are for a different show, making them again")
+            return
+
+        self.frames = index["frames"]
+        self.checkpoints = index["checkpoints"]
+        self.endFrame = index["endFrame"]
+        self.storedBytes = index["storedBytes"]
+
+    def saveIndex(self):
+        index = {
+            "version" : checkpointVersion,
+            "key" : self.key,
+            "fps" : self.fps,
+            "intervalFrames" : self.intervalFrames,
+            "frames" : self.frames,
+            "checkpoints" : self.checkpoints,
+            "endFrame" : self.endFrame,
+            "storedBytes" : self.storedBytes
+        }
+        #Written to a temporary file first so a run reading the checkpoints never sees half of the index
+        temporaryLocation = self.getIndexLocation() + "." + str(os.getpid()) + ".tmp"
+        with open(temporaryLocation, "w") as file:
+            json.dump(index, file)
+        os.replace(temporaryLocation, self.getIndexLocation())
+
+    #Store a snapshot, walking through it alongside the stored checkpoint before it to find arrays that haven't changed
+    #Tuples are kept as {"tuple" : [...]} and arrays saved to disk as {"array" : file name}, so the rest can be saved as json
+    def storeValue(self, value, previous, name):
+        if isinstance(value, dict):
+            if not isinstance(previous, dict):
+                previous = {}
+            return {key : self.storeValue(item, previous.get(key), name + "-" + key) for key, item in value.items()}
+
+        if isinstance(value, (list, tuple)):
+            if isinstance(previous, dict) and "tuple" in previous:
+                previous = previous["tuple"]
+            if not isinstance(previous, list) or len(previous) != len(value):
+                previous = [None] * len(value)
+            items = [self.storeValue(item, previousItem, name + "-" + str(i)) for i, (item, previousItem) in enumerate(zip(value, previous))]
+            if isinstance(value, tuple):
+                return {"tuple" : items}
+            return items
+
+        if isinstance(value, np.ndarray):
+            previousArray = self.loadValue(previous) if isinstance(previous, np.ndarray) or (isinstance(previous, dict) and "array" in previous) else None
+            if previousArray is not None and previousArray.dtype == value.dtype and np.array_equal(previousArray, value):
+                return previous
+
+            self.storedBytes += value.nbytes
+            if self.directory == None:
+                return value
+            fileName = name + ".npy"
+            np.save(os.path.join(self.directory, fileName), value)
+            return {"array" : fileName}
+
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+    #Turn a stored checkpoint back into a snapshot that Scene.setSnapshot can use
+    def loadValue(self, value):
+        if isinstance(value, dict):
+            if "array" in value:
+                fileName = value["array"]
+                if fileName not in self.arrayFiles:
+                    self.arrayFiles[fileName] = np.load(os.path.join(self.directory, fileName), mmap_mode = "r")
+                return self.arrayFiles[fileName]
+            if "tuple" in value:
+                return tuple(self.loadValue(item) for item in value["tuple"])
+            return {key : self.loadValue(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.loadValue(item) for item in value]
+        return value
+
+    def addCheckpoint(self, frameIndex):
+        previous = self.checkpoints[-1] if len(self.checkpoints) > 0 else None
+        self.checkpoints.append(self.storeValue(self.stage.getSnapshot(), previous, str(frameIndex)))
+        self.frames.append(frameIndex)
+
+    #Simulate the show without drawing it up to frameCount frames, taking a checkpoint every interval
+    #The stage should be as it was loaded, or if there are checkpoints already recording carries on from the last one
+    def record(self, frameCount):
+        startTime = time.perf_counter()
+        frameIndex = 0
+        if len(self.frames) > 0:
+            frameIndex = self.frames[-1]
+            self.stage.setSnapshot(self.loadValue(self.checkpoints[-1]))
+
+        try:
+            while frameIndex < frameCount and self.endFrame == None:
+                if frameIndex % self.intervalFrames == 0 and (len(self.frames) == 0 or frameIndex > self.frames[-1]):
+                    self.addCheckpoint(frameIndex)
+                try:
+                    self.stage.update(self.dt if frameIndex > 0 else 0)
+                except SE.end:
+                    self.endFrame = frameIndex
+                frameIndex += 1
+        finally:
+            if self.directory != None:
+                self.saveIndex()
+        self.recordTime += time.perf_counter() - startTime
+
+    #Put the stage in its state at a time in the show, so Scene.composite draws that frame and Scene.render carries on from it
+    #Raises end if the show ends before then
+    def seek(self, seekTime):
+        startTime = time.perf_counter()
+        targetFrame = max(0, int(round(seekTime * self.fps)))
+        if len(self.frames) == 0 or (self.endFrame == None and targetFrame >= self.frames[-1] + self.intervalFrames):
+            self.record(targetFrame + 1)
+
+        checkpointIndex = bisect.bisect_right(self.frames, targetFrame) - 1
+        frameIndex = self.frames[checkpointIndex]
+        self.stage.setSnapshot(self.loadValue(self.checkpoints[checkpointIndex]))
+
+        for frameIndex in range(frameIndex, targetFrame + 1):
+            self.stage.update(self.dt if frameIndex > 0 else 0)
+
+        self.lastSeek = {
+            "time" : time.perf_counter() - startTime,
+            "checkpointFrame" : self.frames[checkpointIndex],
+            "simulatedFrames" : targetFrame + 1 - self.frames[checkpointIndex]
+        }
+
+    #Seek to a time and draw the frame there
+    def renderAt(self, seekTime):
+        self.seek(seekTime)
+        return self.stage.composite()
+
+    def getStats(self):
+        return {
+            "checkpoints" : len(self.frames),
+            "intervalFrames" : self.intervalFrames,
+            "endFrame" : self.endFrame,
+            "storedBytes" : self.storedBytes,
+            "snapshotBytes" : self.getSnapshotBytes(),
+            "recordTime" : self.recordTime,
+            "lastSeek" : self.lastSeek
+        }
+
+    #Bytes the checkpoints would take if no arrays were shared between them
+    def getSnapshotBytes(self):
+        total = 0
+        for checkpoint in self.checkpoints:
+            total += getArrayBytes(self.loadValue(checkpoint))
+        return total
+
+def getArrayBytes(value):
+    if isinstance(value, dict):
+        return sum(getArrayBytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(getArrayBytes(item) for item in value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return 0
@@ -0,0 +1,201 @@
+import csv
+import json
+import time
+import tracemalloc
+import numpy as np
+import sceneElements as SE
+
+#Parts of a frame that make up the whole frame, smaller parts such as advect are timed inside these
+mainStages = ["smoke", "movement", "lights", "objects", "composite"]
+
+#Records how long each part of every frame took, keeping only the newest frames in a ring buffer
+#A stage is only profiled while Scene.setProfiler has given it a profiler, without one the stage only checks for None
+class FrameProfiler:
+    def __init__(self, capacity = 600, maxStages = 16, traceMemory = False):
+        self.capacity = capacity
+        self.stageNames = []
+        self.stageIndices = {}
+        self.maxStages = maxStages
+        self.originTime = time.perf_counter()   #Trace times are measured from when the profiler was made
+
+        #One row per frame, the row for frame n is n % capacity
+        self.frameStarts = np.zeros(capacity)
+        self.frameTimes = np.zeros(capacity)
+        self.stageStarts = np.zeros([capacity, maxStages])
+        self.stageTimes = np.zeros([capacity, maxStages])
+        self.particles = np.zeros(capacity, int)
+        self.coneCacheHits = np.zeros(capacity, int)
+        self.coneCacheMisses = np.zeros(capacity, int)
+        self.allocatedBytes = np.zeros(capacity, int)
+        self.reusedLayers = np.zeros([capacity, len(SE.reuseLayerNames)], bool)   #Layers the scene reused instead of drawing each frame
+        self.frameCount = 0                     #Frames recorded so far, including ones that have been overwritten
+
+        #Memory is traced with tracemalloc, which slows everything down so is only done when asked for
+        self.traceMemory = traceMemory
+        if traceMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.frameMemory = 0
+        self.lastConeCacheStats = SE.Light.coneCache.getStats()
+        self.lastReuseCounts = None
+
+    def getRow(self):
+        return self.frameCount % self.capacity
+
+    def beginFrame(self):
+        row = self.getRow()
+        self.stageStarts[row] = 0
+        self.stageTimes[row] = 0
+        if self.traceMemory:
+            tracemalloc.reset_peak()
+            self.frameMemory = tracemalloc.get_traced_memory()[0]
+        self.frameStarts[row] = time.perf_counter()
+
+    def startStage(self):
+        return time.perf_counter()
+
+    #Add the time since startTime to a stage, returning the time now so the next stage can start from it
+    def endStage(self, stageName, startTime):
+        endTime = time.perf_counter()
+        self.addStage(stageName, startTime, endTime)
+        return endTime
+
+    #Add a stage that has already finished, eg one that ran on another thread
+    def addStage(self, stageName, startTime, endTime):
+        if stageName not in self.stageIndices:
+            if len(self.stageNames) == self.maxStages:
+                return
+            self.stageIndices[stageName] = len(self.stageNames)
+            self.stageNames.append(stageName)
+
+        row = self.getRow()
+        stageIndex = self.stageIndices[stageName]
+        if self.stageTimes[row, stageIndex] == 0:
+            self.stageStarts[row, stageIndex] = startTime
+        self.stageTimes[row, stageIndex] += endTime - startTime
+
+    #Finish the frame and record the counters of the scene it was drawn from
+    def endFrame(self, scene):
+        row = self.getRow()
+        self.frameTimes[row] = time.perf_counter() - self.frameStarts[row]
+
+        self.particles[row] = scene.smoke.particles.count
+        coneCacheStats = SE.Light.coneCache.getStats()
+        self.coneCacheHits[row] = coneCacheStats["hits"] - self.lastConeCacheStats["hits"]
+        self.coneCacheMisses[row] = coneCacheStats["misses"] - self.lastConeCacheStats["misses"]
+        self.lastConeCacheStats = coneCacheStats
+
+        if self.lastReuseCounts != None:
+            self.reusedLayers[row] = [scene.reuseCounts[layerName] > self.lastReuseCounts[layerName] for layerName in SE.reuseLayerNames]
+        self.lastReuseCounts = dict(scene.reuseCounts)
+
+        if self.traceMemory:
+            self.allocatedBytes[row] = tracemalloc.get_traced_memory()[1] - self.frameMemory
+
+        self.frameCount += 1
+
+    #Rows of the frames still held, oldest first
+    def getRows(self, frameCount = None):
+        heldFrames = min(self.frameCount, self.capacity)
+        if frameCount != None:
+            heldFrames = min(heldFrames, frameCount)
+        return [frame % self.capacity for frame in range(self.frameCount - heldFrames, self.frameCount)]
+
+    #Every frame still held as a dictionary, times are in milliseconds
+    def getFrames(self):
+        frames = []
+        for frame, row in zip(range(self.frameCount - len(self.getRows()), self.frameCount), self.getRows()):
+            record = {
+                "frame" : frame,
+                "time" : float(self.frameStarts[row] - self.originTime) * 1000,
+                "frameMs" : float(self.frameTimes[row]) * 1000
+            }
+            for stageName, stageIndex in self.stageIndices.items():
+                record[stageName + "Ms"] = float(self.stageTimes[row, stageIndex]) * 1000
+            record["particles"] = int(self.particles[row])
+            record["coneCacheHits"] = int(self.coneCacheHits[row])
+            record["coneCacheMisses"] = int(self.coneCacheMisses[row])
+            record["allocatedBytes"] = int(self.allocatedBytes[row])
+            for layerIndex, layerName in enumerate(SE.reuseLayerNames):
+                record[layerName + "Reused"] = bool(self.reusedLayers[row, layerIndex])
+            frames.append(record)
+        return frames
+
+    #Average frame rate and main stage times over the newest frames
+    def getSummary(self, frameCount = 30):
+        rows = self.getRows(frameCount)
+        summary = {"fps" : 0.0}
+        if len(rows) == 0:
+            return summary
+
+        frameTime = self.frameTimes[rows].mean()
+        summary["fps"] = 1 / frameTime if frameTime > 0 else 0.0
+        for stageName in mainStages:
+            if stageName in self.stageIndices:
+                summary[stageName] = self.stageTimes[rows, self.stageIndices[stageName]].mean() * 1000
+        summary["particles"] = int(self.particles[rows[-1]])
+        summary["framesReused"] = float(self.reusedLayers[rows, SE.reuseLayerNames.index("frame")].mean())
+        return summary
+
+    def getSummaryText(self, frameCount = 30):
+        summary = self.getSummary(frameCount)
+        text = ("%.1f" % summary["fps"]) + " fps"
+        for stageName in mainStages:
+            if stageName in summary:
+                text += "  " + stageName + " " + ("%.1f" % summary[stageName])
+        text += " ms"
+        if summary.get("framesReused", 0) > 0:
+            text += "  " + ("%.0f" % (100 * summary["framesReused"])) + "% of frames reused"
+        return text
+
+    def saveCsv(self, outputLocation):
+        frames = self.getFrames()
+        if len(frames) == 0:
+            return
+        with open(outputLocation, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(frames[-1]))
+            writer.writeheader()
+            writer.writerows(frames)
+
+    def saveJson(self, outputLocation):
+        with open(outputLocation, "w") as file:
+            json.dump({"stages" : self.stageNames, "frames" : self.getFrames()}, file, indent=4)
+
+    #Save the frames in the Chrome trace event format, which can be opened in chrome://tracing or Perfetto
+    #Each frame and stage is a complete event, counters are drawn as graphs under them
+    #Every stage has its own row, so stages that overlap when the frame is drawn on several threads can be seen
+    def saveTrace(self, outputLocation):
+        events = [{"name" : "thread_name", "ph" : "M", "pid" : 0, "tid" : 0, "args" : {"name" : "frame"}}]
+        for stageName, stageIndex in self.stageIndices.items():
+            events.append({"name" : "thread_name", "ph" : "M", "pid" : 0, "tid" : stageIndex + 1, "args" : {"name" : stageName}})
+        for frame in self.getFrames():
+            row = frame["frame"] % self.capacity
+            frameEvent = self.getTraceEvent("frame", self.frameStarts[row], self.frameTimes[row])
+            frameEvent["args"] = {"frame" : frame["frame"]}
+            events.append(frameEvent)
+            for stageName, stageIndex in self.stageIndices.items():
+                if self.stageTimes[row, stageIndex] > 0:
+                    events.append(self.getTraceEvent(stageName, self.stageStarts[row, stageIndex], self.stageTimes[row, stageIndex], stageIndex + 1))
+
+            counters = {
+                "particles" : frame["particles"],
+                "coneCacheMisses" : frame["coneCacheMisses"],
+                "frameReused" : int(frame["frameReused"])
+            }
+            if self.traceMemory:
+                counters["allocatedBytes"] = frame["allocatedBytes"]
+            for counterName, value in counters.items():
+                events.append({"name" : counterName, "ph" : "C", "ts" : frame["time"] * 1000, "pid" : 0, "args" : {counterName : value}})
+
+        with open(outputLocation, "w") as file:
+            json.dump({"traceEvents" : events, "displayTimeUnit" : "ms"}, file)
+
+    #Trace times are in microseconds
+    def getTraceEvent(self, name, startTime, duration, threadIndex = 0):
+        return {
+            "name" : name,
+            "ph" : "X",
+            "ts" : (startTime - self.originTime) * 1e6,
+            "dur" : duration * 1e6,
+            "pid" : 0,
+            "tid" : threadIndex
+        }
@@ -0,0 +1,285 @@
+import os
+import queue
+import sys
+import threading
+import time
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+import sceneElements as SE
+
+#Layout of the header at the start of the shared memory, every value is a 64 bit integer
+#Fixed fields come first so a reader can find out the size of everything else
+headerFields = ["latestSequence", "slotCount", "verticalSize", "horizontalSize", "maxReaders"]
+frameAlignment = 64
+
+#Turn a frame from Scene.render into 8 bit red green blue with the top row first, the layout raw video tools expect
+#scratch is a float32 array the size of the frame, so nothing new is made each frame
+def frameToRgb(frame, image, scratch):
+    np.multiply(frame[::-1], 255, out=scratch)
+    scratch += 0.5
+    np.clip(scratch, 0, 255, out=scratch)
+    np.copyto(image, scratch, casting="unsafe")
+
+def getHeaderSize(slotCount, maxReaders):
+    #Fixed fields, then the sequence in each slot, then the last sequence read and frames missed by each reader
+    headerSize = (len(headerFields) + slotCount + 2 * maxReaders) * 8
+    return -(-headerSize // frameAlignment) * frameAlignment
+
+#Splits shared memory into the header values and the frame slots
+class SharedFrameLayout:
+    def __init__(self, sharedMemory):
+        self.sharedMemory = sharedMemory
+        fixed = np.ndarray(len(headerFields), np.int64, sharedMemory.buf)
+        self.slotCount, self.verticalSize, self.horizontalSize, self.maxReaders = [int(value) for value in fixed[1:]]
+
+        header = np.ndarray(getHeaderSize(self.slotCount, self.maxReaders) // 8, np.int64, sharedMemory.buf)
+        self.header = header
+        start = len(headerFields)
+        self.slotSequences = header[start:start + self.slotCount]
+        start += self.slotCount
+        self.readerSequences = header[start:start + self.maxReaders]
+        start += self.maxReaders
+        self.readerDrops = header[start:start + self.maxReaders]
+
+        frameShape = (self.slotCount, self.verticalSize, self.horizontalSize, 3)
+        self.slots = np.ndarray(frameShape, np.uint8, sharedMemory.buf, getHeaderSize(self.slotCount, self.maxReaders))
+
+    def getLatestSequence(self):
+        return int(self.header[0])
+
+    #Views have to be let go of before the shared memory can be closed
+    def release(self):
+        self.header = self.slotSequences = self.readerSequences = self.readerDrops = self.slots = None
+
+#Publishes frames into a ring of slots in shared memory that other processes on the same machine can read without copying
+#Each slot holds the sequence number of the frame in it, which is set to -1 while the frame is being written
+#The producer never waits for readers, it just writes over the oldest slot, so a reader that falls behind misses frames
+#Readers that say which reader index they are keep the last sequence they read and how many frames they missed in the header
+class SharedFrameRing:
+    def __init__(self, name, horizontalSize, verticalSize, slotCount = 4, maxReaders = 4):
+        size = getHeaderSize(slotCount, maxReaders) + slotCount * verticalSize * horizontalSize * 3
+        try:
+            self.sharedMemory = shared_memory.SharedMemory(name, create = True, size = size)
+        except FileExistsError:
+            #Usually left behind by a run that crashed, readers that still have it open keep their copy
+            print("Shared memory " + name + " already exists, replacing it, give --stream-shm a different name if another show is still using it")
+            staleMemory = shared_memory.SharedMemory(name)
+            staleMemory.close()
+            staleMemory.unlink()
+            self.sharedMemory = shared_memory.SharedMemory(name, create = True, size = size)
+
+        fixed = np.ndarray(len(headerFields), np.int64, self.sharedMemory.buf)
+        fixed[:] = [-1, slotCount, verticalSize, horizontalSize, maxReaders]
+        del fixed
+        self.layout = SharedFrameLayout(self.sharedMemory)
+        self.layout.slotSequences[:] = -1
+        self.layout.readerSequences[:] = -1
+        self.layout.readerDrops[:] = 0
+
+        self.scratch = np.zeros([verticalSize, horizontalSize, 3], np.float32)
+        self.sequence = 0
+        self.writtenFrames = 0
+
+    def write(self, frame):
+        layout = self.layout
+        slot = self.sequence % layout.slotCount
+        layout.slotSequences[slot] = -1
+        frameToRgb(frame, layout.slots[slot], self.scratch)
+        layout.slotSequences[slot] = self.sequence
+        layout.header[0] = self.sequence
+
+        self.sequence += 1
+        self.writtenFrames += 1
+
+    def getStats(self):
+        if self.layout.slots is None:
+            return self.finalStats
+        #Frames each reader has missed so far
+        readerDrops = [int(drops) for drops in self.layout.readerDrops]
+        return {
+            "writtenFrames" : self.writtenFrames,
+            "droppedFrames" : sum(readerDrops),
+            "readerDrops" : readerDrops
+        }
+
+    #Removes the shared memory, readers that still have it open keep their copy until they close it
+    def close(self):
+        self.finalStats = self.getStats()
+        self.layout.release()
+        self.sharedMemory.close()
+        self.sharedMemory.unlink()
+
+#Reads frames from a SharedFrameRing made by another process
+#readerIndex is optional, when given the ring counts the frames this reader misses
+class SharedFrameReader:
+    def __init__(self, name, readerIndex = None):
+        #The producer removes the shared memory, so this process must not have it removed when it exits
+        try:
+            self.sharedMemory = shared_memory.SharedMemory(name, track = False)
+        except TypeError:
+            self.sharedMemory = shared_memory.SharedMemory(name)
+            resource_tracker.unregister(self.sharedMemory._name, "shared_memory")
+        self.layout = SharedFrameLayout(self.sharedMemory)
+        self.readerIndex = readerIndex
+        self.lastSequence = -1
+        self.missedFrames = 0
+
+        if readerIndex != None:
+            if readerIndex >= self.layout.maxReaders:
+                raise ValueError("Reader index " + str(readerIndex) + " is more than the ring has room for")
+            self.layout.readerSequences[readerIndex] = self.layout.getLatestSequence()
+            self.layout.readerDrops[readerIndex] = 0
+
+    #Returns the sequence number and a view of the newest frame, or None if there is no frame newer than the last one read
+    #The view is of the shared memory, so isCurrent should be checked after using it in case it was written over
+    def getFrame(self):
+        sequence = self.layout.getLatestSequence()
+        if sequence < 0 or sequence == self.lastSequence:
+            return None
+
+        slot = sequence % self.layout.slotCount
+        if self.layout.slotSequences[slot] != sequence:
+            return None
+
+        if self.lastSequence >= 0:
+            self.missedFrames += sequence - self.lastSequence - 1
+        self.lastSequence = sequence
+        if self.readerIndex != None:
+            self.layout.readerSequences[self.readerIndex] = sequence
+            self.layout.readerDrops[self.readerIndex] = self.missedFrames
+        return sequence, self.layout.slots[slot]
+
+    #Whether the frame with this sequence number is still in its slot
+    def isCurrent(self, sequence):
+        return self.layout.slotSequences[sequence % self.layout.slotCount] == sequence
+
+    def close(self):
+        if self.readerIndex != None:
+            self.layout.readerSequences[self.readerIndex] = -1
+        self.layout.release()
+        self.sharedMemory.close()
+
+#Writes raw 8 bit red green blue frames to stdout, when the location is -, or a named pipe, for tools such as ffmpeg
+#Writing happens on its own thread through a small queue, when the reader is slow the oldest waiting frame is dropped
+#A named pipe that doesn't exist is made, frames are dropped until something opens the other end
+class FramePipeWriter(threading.Thread):
+    def __init__(self, outputLocation, horizontalSize, verticalSize, queueSize = 2):
+        super().__init__(daemon = True)
+        self.outputLocation = outputLocation
+        self.frames = queue.Queue(max(1, queueSize))
+        self.lock = threading.Lock()
+        self.error = None
+        self.connected = threading.Event()
+
+        self.image = np.zeros([verticalSize, horizontalSize, 3], np.uint8)
+        self.scratch = np.zeros([verticalSize, horizontalSize, 3], np.float32)
+        self.writtenFrames = 0
+        self.droppedFrames = 0
+
+        if outputLocation == "-":
+            #Anything printed would end up in the frames, so prints go to stderr while the frames use stdout
+            self.fileDescriptor = sys.stdout.fileno()
+            sys.stdout.flush()
+            sys.stdout = sys.stderr
+            self.connected.set()
+        else:
+            self.fileDescriptor = None
+            if not os.path.exists(outputLocation):
+                os.mkfifo(outputLocation)
+        self.start()
+
+    #Opening a named pipe waits for a reader, so it is done here rather than by the producer
+    def run(self):
+        try:
+            if self.fileDescriptor == None:
+                self.fileDescriptor = os.open(self.outputLocation, os.O_WRONLY)
+                self.connected.set()
+
+            #None is queued by close once every frame has been queued
+            while True:
+                frame = self.frames.get()
+                if frame is None:
+                    break
+                view = memoryview(frame)
+                while len(view) > 0:
+                    view = view[os.write(self.fileDescriptor, view):]
+                self.writtenFrames += 1
+        except BrokenPipeError:
+            print("Reader of " + self.outputLocation + " closed the pipe")
+        except Exception as error:
+            self.error = error
+
+    #Queue a frame without waiting, dropping the oldest waiting frame to make room
+    def write(self, frame):
+        if self.error != None:
+            raise self.error
+        if not self.connected.is_set() or not self.is_alive():
+            with self.lock:
+                self.droppedFrames += 1
+            return
+
+        frameToRgb(frame, self.image, self.scratch)
+        item = self.image.tobytes()
+        while True:
+            try:
+                self.frames.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    with self.lock:
+                        self.droppedFrames += 1
+                except queue.Empty:
+                    pass
+
+    def getStats(self):
+        return {
+            "writtenFrames" : self.writtenFrames,
+            "droppedFrames" : self.droppedFrames
+        }
+
+    #Write any frames still waiting, unless the reader has gone or never came
+    def close(self):
+        while self.connected.is_set() and self.is_alive():
+            try:
+                self.frames.put(None, timeout = 0.1)
+                break
+            except queue.Full:
+                pass
+        if self.connected.is_set():
+            self.join()
+            if self.outputLocation != "-":
+                os.close(self.fileDescriptor)
+
+#Render the stage in real time and send every frame to each output, anything with write, getStats and close methods
+#Rendering is never held up by the outputs, frames they can't keep up with are dropped and counted
+#started means the stage is already on its first frame, eg after a checkpoint seek, so that frame is only drawn
+def streamFrames(stage, outputs, fps = 30, duration = 60, started = False):
+    dt = 1 / fps
+    frameCount = int(round(duration * fps))
+    framesRendered = 0
+    startTime = time.perf_counter()
+    try:
+        for i in range(frameCount):
+            if i == 0 and started:
+                frame = stage.composite()
+            else:
+                frame = stage.render(dt if i > 0 else 0)
+            for output in outputs:
+                output.write(frame)
+            framesRendered += 1
+
+            #Wait for the time the next frame is due, if rendering is behind the next frame starts straight away
+            waitTime = startTime + (i + 1) * dt - time.perf_counter()
+            if waitTime > 0:
+                time.sleep(waitTime)
+    except SE.end:
+        pass
+    finally:
+        for output in outputs:
+            output.close()
+
+    stats = [output.getStats() for output in outputs]
+    for output, outputStats in zip(outputs, stats):
+        print(type(output).__name__ + " wrote " + str(outputStats["writtenFrames"]) + " of " + str(framesRendered) + " frames, " + str(outputStats["droppedFrames"]) + " dropped")
+    return stats
@@ -0,0 +1,235 @@
+import queue
+import threading
+import time
+import numpy as np
+from matplotlib.patches import Wedge, Polygon
+
+#Runs the stage on its own thread and hands finished frames to the display through a small queue
+#NumPy and cv2 let go of the GIL while they work, so the next frame is simulated while matplotlib draws the last one
+#When the display falls behind the oldest waiting frame is thrown away, so what is shown is never more than a few frames old
+class FrameProducer(threading.Thread):
+    def __init__(self, stage, queueSize = 2, started = False):
+        super().__init__(daemon = True)
+        self.stage = stage
+        self.started = started          #The stage is already on its first frame, eg after a checkpoint seek
+        self.frames = queue.Queue(max(1, queueSize))
+        self.stopEvent = threading.Event()
+        self.lock = threading.Lock()    #Both threads throw away frames, so the drop count is shared
+        self.error = None               #Anything that stopped the stage, passed on to the display
+
+        self.producedFrames = 0
+        self.displayedFrames = 0
+        self.droppedFrames = 0
+
+    #Simulate and draw frames until stopped, dt is the real time since the last frame started so the show runs at real speed
+    def run(self):
+        dt = 0
+        lastTime = time.monotonic()
+        try:
+            while not self.stopEvent.is_set():
+                if self.started and self.producedFrames == 0:
+                    frame = self.stage.composite()
+                else:
+                    frame = self.stage.render(dt)
+
+                #The stage reuses its buffers, so the frame is copied before another thread gets it
+                frame = frame.copy()
+                lightOverview = self.stage.getLightOverview()
+                self.putFrame((frame, lightOverview))
+                self.producedFrames += 1
+
+                startTime = time.monotonic()
+                dt = startTime - lastTime
+                lastTime = startTime
+        except Exception as error:
+            self.error = error
+
+    #Add a frame without waiting, making room by dropping the oldest one
+    def putFrame(self, item):
+        while True:
+            try:
+                self.frames.put_nowait(item)
+                return
+            except queue.Full:
+                self.dropFrame()
+
+    def dropFrame(self):
+        try:
+            self.frames.get_nowait()
+        except queue.Empty:
+            return False
+        with self.lock:
+            self.droppedFrames += 1
+        return True
+
+    #Wait for the newest frame and its light overview, any older frames still waiting are dropped
+    #Returns None once the stage has stopped and every frame has been shown, raising whatever stopped it
+    def getFrame(self):
+        item = None
+        while item == None:
+            try:
+                item = self.frames.get(timeout = 0.1)
+            except queue.Empty:
+                if not self.is_alive():
+                    if self.error != None:
+                        raise self.error
+                    return None
+
+        while True:
+            try:
+                newer = self.frames.get_nowait()
+            except queue.Empty:
+                break
+            with self.lock:
+                self.droppedFrames += 1
+            item = newer
+
+        self.displayedFrames += 1
+        return item
+
+    def stop(self):
+        self.stopEvent.set()
+        self.join()
+
+    def getStats(self):
+        return {
+            "queueDepth" : self.frames.qsize(),
+            "producedFrames" : self.producedFrames,
+            "displayedFrames" : self.displayedFrames,
+            "droppedFrames" : self.droppedFrames
+        }
+
+#Draws the light overview panel, the wedge and parralelogram for each light are made once and then moved and recolored
+class LightOverview:
+    def __init__(self, axes, lightCount, animated = True):
+        self.axes = axes
+        axes.set_xlim([0, 512])
+        axes.set_ylim([0, 32])
+        axes.set_facecolor('k')
+
+        self.wedges = []
+        self.lasers = []
+        for i in range(lightCount):
+            self.wedges.append(axes.add_patch(Wedge((0, 0), 20, 0, 0, animated = animated)))
+            self.lasers.append(axes.add_patch(Polygon(np.zeros([4, 2]), closed = True, animated = animated)))
+        self.lastOverview = None
+
+    def getArtists(self):
+        return self.wedges + self.lasers
+
+    #Move and recolor the patches of lights that have changed, returns True if any did
+    def update(self, overview):
+        if len(self.wedges) == 0:
+            return False
+
+        changed = np.ones(len(self.wedges), bool)
+        if self.lastOverview != None:
+            changed[:] = False
+            for name in overview:
+                difference = overview[name] != self.lastOverview[name]
+                changed |= difference.reshape(len(changed), -1).any(1)
+        self.lastOverview = overview
+
+        for i in np.flatnonzero(changed):
+            self.wedges[i].set_center(overview["centers"][i])
+            self.wedges[i].set_theta1(overview["minAngles"][i])
+            self.wedges[i].set_theta2(overview["maxAngles"][i])
+            self.lasers[i].set_xy(overview["laserCorners"][i])
+            self.wedges[i].set_facecolor(overview["colors"][i])
+            self.lasers[i].set_facecolor(overview["colors"][i])
+        return changed.any()
+
+#Redraws only the animated artists of a figure over a saved copy of everything else
+#Each group is an axes and its artists, only groups that have changed are drawn and copied to the window
+class Blitter:
+    def __init__(self, canvas, groups):
+        self.canvas = canvas
+        self.groups = groups
+        self.backgrounds = None
+        self.canvas.mpl_connect("draw_event", self.onDraw)
+
+    #The figure has been fully drawn, eg after a resize, so the saved copies are out of date
+    def onDraw(self, event):
+        self.backgrounds = [self.canvas.copy_from_bbox(axes.bbox) for axes, artists in self.groups]
+        for axes, artists in self.groups:
+            self.drawArtists(artists)
+
+    def drawArtists(self, artists):
+        for artist in artists:
+            self.canvas.figure.draw_artist(artist)
+
+    def update(self, changedGroups):
+        if self.backgrounds == None:
+            self.canvas.draw()
+        else:
+            for i in changedGroups:
+                axes, artists = self.groups[i]
+                self.canvas.restore_region(self.backgrounds[i])
+                self.drawArtists(artists)
+                self.canvas.blit(axes.bbox)
+        self.canvas.flush_events()
+
+#Show the stage in a matplotlib window with the simulation running on its own thread
+#If the stage has a profiler its frame rate and stage times are shown over the stage along with the display frame rate
+def renderLive(stage, frameCount = 10000, queueSize = 2, started = False):
+    import matplotlib.pyplot as plt
+
+    producer = FrameProducer(stage, queueSize, started)
+
+    fig, axs = plt.subplots(nrows = 2, ncols = 1, figsize = (6, 6), gridspec_kw={'height_ratios': [1, 6]})
+    producer.start()
+    try:
+        item = producer.getFrame()
+        if item == None:
+            return producer.getStats()
+        frame, lightOverview = item
+
+        #Only the stage image and light patches change, so if the window can blit just they are redrawn each frame
+        animated = fig.canvas.supports_blit
+        image = axs[1].imshow(frame, origin='lower', animated = animated)
+        overview = LightOverview(axs[0], len(lightOverview["centers"]), animated)
+        overview.update(lightOverview)
+
+        stageArtists = [image]
+        profileText = None
+        if stage.profiler != None:
+            profileText = axs[1].text(0.01, 0.01, "", transform = axs[1].transAxes, color = 'w', fontsize = 7, animated = animated)
+            stageArtists.append(profileText)
+        displayTimes = []
+
+        blitter = None
+        if animated:
+            blitter = Blitter(fig.canvas, [(axs[1], stageArtists), (axs[0], overview.getArtists())])
+        plt.show(block = False)
+        plt.pause(0.0001)
+
+        #Main display loop, shows the newest frame each time the window is ready for one
+        for i in range(frameCount):
+            if not plt.fignum_exists(fig.number):
+                break
+
+            item = producer.getFrame()
+            if item == None:
+                break
+            frame, lightOverview = item
+
+            image.set_data(frame)
+            if profileText != None:
+                displayTimes = displayTimes[-30:] + [time.monotonic()]
+                displayFps = (len(displayTimes) - 1) / (displayTimes[-1] - displayTimes[0]) if len(displayTimes) > 1 else 0
+                profileText.set_text("stage " + stage.profiler.getSummaryText() + "\ndisplay " + ("%.1f" % displayFps) + " fps")
+            changedGroups = [0]
+            if overview.update(lightOverview):
+                changedGroups.append(1)
+
+            if blitter != None:
+                blitter.update(changedGroups)
+            else:
+                plt.draw()
+                plt.pause(0.0001)
+    finally:
+        producer.stop()
+
+    stats = producer.getStats()
+    print("Displayed " + str(stats["displayedFrames"]) + " of " + str(stats["producedFrames"]) + " frames, " + str(stats["droppedFrames"]) + " dropped")
+    return stats
@@ -0,0 +1,87 @@
+import os
+import time
+import numpy as np
+import cv2
+import sceneElements as SE
+
+#Video formats that can be written, chosen from the output file extension
+videoCodecs = {
+    ".mp4" : "mp4v",
+    ".avi" : "MJPG",
+    ".mkv" : "mp4v"
+}
+
+#Convert a frame from Scene.render into an 8 bit image the right way up for saving, with colors in the blue green red order cv2 uses
+def frameToImage(frame):
+    image = np.clip(frame[::-1, :, ::-1] * 255 + 0.5, 0, 255)
+    return image.astype(np.uint8)
+
+#Writes frames either to a video file or, if the location has a frame number pattern such as frames/%05d.png, to one image per frame
+class FrameWriter:
+    def __init__(self, outputLocation, fps, horizontalSize, verticalSize):
+        self.outputLocation = outputLocation
+        self.frameIndex = 0
+        self.video = None
+
+        if "%" not in outputLocation:
+            extension = os.path.splitext(outputLocation)[1].lower()
+            if extension not in videoCodecs:
+                raise ValueError("Video format " + extension + " is not supported")
+
+            fourcc = cv2.VideoWriter_fourcc(*videoCodecs[extension])
+            self.video = cv2.VideoWriter(outputLocation, fourcc, fps, [int(horizontalSize), int(verticalSize)])
+            if not self.video.isOpened():
+                raise IOError("Could not open " + outputLocation + " for writing")
+        else:
+            #Image sequences are saved into a folder that is made if it doesn't exist
+            directory = os.path.dirname(outputLocation)
+            if directory != "":
+                os.makedirs(directory, exist_ok = True)
+
+    def write(self, image):
+        if self.video != None:
+            self.video.write(image)
+        else:
+            imageLocation = self.outputLocation % self.frameIndex
+            if not cv2.imwrite(imageLocation, image):
+                raise IOError("Could not write " + imageLocation)
+        self.frameIndex += 1
+
+    def close(self):
+        if self.video != None:
+            self.video.release()
+
+#Render the stage at a fixed timestep without any display and save every frame
+#Stops after duration seconds of show time or when the choreography ends
+#started means the stage is already on its first frame, eg after a checkpoint seek, so that frame is only drawn
+def renderOffline(stage, outputLocation, fps = 30, duration = 60, started = False):
+    dt = 1 / fps
+    frameCount = int(round(duration * fps))
+    writer = FrameWriter(outputLocation, fps, stage.horizontalSize, stage.verticalSize)
+
+    framesRendered = 0
+    startTime = time.perf_counter()
+    try:
+        for i in range(frameCount):
+            #The first frame shows the stage as loaded
+            if i == 0 and started:
+                frame = stage.composite()
+            else:
+                frame = stage.render(dt if i > 0 else 0)
+            writer.write(frameToImage(frame))
+            framesRendered += 1
+    except SE.end:
+        pass
+    finally:
+        writer.close()
+    renderTime = time.perf_counter() - startTime
+
+    renderFps = framesRendered / renderTime if renderTime > 0 else 0
+    print("Rendered " + str(framesRendered) + " frames in " + ("%.2f" % renderTime) + "s, " + ("%.1f" % renderFps) + " fps, " + ("%.2f" % (renderFps / fps)) + "x real time")
+
+    return {
+        "frames" : framesRendered,
+        "renderTime" : renderTime,
+        "fps" : renderFps,
+        "realTimeFactor" : renderFps / fps
+    }
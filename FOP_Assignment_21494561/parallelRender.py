@@ -0,0 +1,146 @@
+import os
+import math
+import collections
+import shutil
+import tempfile
+import time
+import multiprocessing
+import numpy as np
+import sceneElements as SE
+import stageLoader
+import offlineRender
+
+#Stage loaded once in each worker process, chunks restore a snapshot into it rather than reloading the choreography
+workerStage = None
+workerVelocityScreen = None     #Velocity screen of the main process when it never changes, so it isn't sent with every chunk
+
+def startWorker(choreogrpahyLocation, useCache = True, velocityScreen = None, sceneOptions = None):
+    global workerStage, workerVelocityScreen
+    workerStage = stageLoader.loadStage(choreogrpahyLocation, useCache, sceneOptions)
+    workerVelocityScreen = velocityScreen
+
+#Render one chunk of the show starting from a snapshot
+#Frames are saved as raw images so joining the chunks does not compress the video twice
+def renderChunk(chunk):
+    snapshot, firstFrame, frameCount, dt, chunkLocation = chunk
+    if "velocityScreen" not in snapshot["smoke"]:
+        snapshot["smoke"]["velocityScreen"] = workerVelocityScreen
+    workerStage.setSnapshot(snapshot)
+
+    frames = np.lib.format.open_memmap(chunkLocation, "w+", np.uint8, (frameCount, workerStage.verticalSize, workerStage.horizontalSize, 3))
+    for i in range(frameCount):
+        #The first frame of the show is drawn without moving anything
+        frameIndex = firstFrame + i
+        workerStage.update(dt if frameIndex > 0 else 0)
+        frames[i] = offlineRender.frameToImage(workerStage.composite())
+    frames.flush()
+    del frames
+
+    return chunkLocation
+
+#Simulate the show without drawing it, giving the snapshot at the start of each chunk, its first frame and its number of frames
+#Chunks are made one at a time as they are asked for, so only the snapshots of chunks waiting to be rendered are kept
+#staticKeys are left out of the smoke snapshots, as the workers already have them
+def getChunks(stage, frameCount, chunkSize, dt, staticKeys = []):
+    frameIndex = 0
+    while frameIndex < frameCount:
+        snapshot = stage.getSnapshot()
+        for key in staticKeys:
+            del snapshot["smoke"][key]
+        firstFrame = frameIndex
+        lastFrame = min(firstFrame + chunkSize, frameCount)
+
+        try:
+            while frameIndex < lastFrame:
+                stage.update(dt if frameIndex > 0 else 0)
+                frameIndex += 1
+        except SE.end:
+            #The frame the show ends on is not drawn
+            if frameIndex > firstFrame:
+                yield snapshot, firstFrame, frameIndex - firstFrame
+            return
+
+        yield snapshot, firstFrame, frameIndex - firstFrame
+
+#Write every frame of a finished chunk then delete it, returning the number of frames written
+def writeChunk(writer, chunkLocation):
+    frameCount = 0
+    for image in np.load(chunkLocation, mmap_mode="r"):
+        writer.write(np.ascontiguousarray(image))
+        frameCount += 1
+    os.remove(chunkLocation)
+    return frameCount
+
+#Render the show across several processes, each rendering a chunk of the show from a snapshot
+#The main process only simulates the stage to find the snapshot at the start of each chunk, staying a few chunks ahead of the workers
+#The chunks are joined in order
+def renderParallel(choreogrpahyLocation, outputLocation, fps = 30, duration = 60, workers = None, chunkSize = None, useCache = True, sceneOptions = None):
+    if workers == None:
+        workers = os.cpu_count()
+
+    dt = 1 / fps
+    frameCount = int(round(duration * fps))
+    if chunkSize == None:
+        #Several chunks per worker so workers that finish early can pick up more work
+        chunkSize = max(1, int(math.ceil(frameCount / (workers * 4))))
+
+    startTime = time.perf_counter()
+    stage = stageLoader.loadStage(choreogrpahyLocation, useCache, sceneOptions)
+
+    #Without a flow volume the velocity screen never changes, so it is given to each worker once instead of with every chunk
+    velocityScreen = None
+    staticKeys = []
+    if stage.smoke.flowVolume == None:
+        velocityScreen = stage.smoke.velocityScreen
+        staticKeys = ["velocityScreen"]
+
+    chunkDirectory = tempfile.mkdtemp()
+    writer = offlineRender.FrameWriter(outputLocation, fps, stage.horizontalSize, stage.verticalSize)
+    framesRendered = 0
+    firstChunkTime = None       #Time until the first chunk was handed to a worker
+    snapshotTime = 0.0          #Time the main process spent simulating the show on its own to make the chunk snapshots
+    try:
+        with multiprocessing.Pool(workers, startWorker, (choreogrpahyLocation, useCache, velocityScreen, sceneOptions)) as pool:
+            #Chunks are handed out a few per worker at a time and come back in order
+            #Each is written out and deleted as soon as it and every chunk before it is done
+            waitingChunks = collections.deque()
+            chunks = getChunks(stage, frameCount, chunkSize, dt, staticKeys)
+            chunkIndex = 0
+            while True:
+                snapshotStartTime = time.perf_counter()
+                chunk = next(chunks, None)
+                snapshotTime += time.perf_counter() - snapshotStartTime
+                if chunk == None:
+                    break
+
+                snapshot, firstFrame, chunkFrameCount = chunk
+                chunkLocation = os.path.join(chunkDirectory, str(chunkIndex) + ".npy")
+                waitingChunks.append(pool.apply_async(renderChunk, ((snapshot, firstFrame, chunkFrameCount, dt, chunkLocation),)))
+                chunkIndex += 1
+                if firstChunkTime == None:
+                    firstChunkTime = time.perf_counter() - startTime
+                if len(waitingChunks) >= 2 * workers:
+                    framesRendered += writeChunk(writer, waitingChunks.popleft().get())
+
+            while len(waitingChunks) > 0:
+                framesRendered += writeChunk(writer, waitingChunks.popleft().get())
+    finally:
+        writer.close()
+        shutil.rmtree(chunkDirectory, ignore_errors=True)
+    renderTime = time.perf_counter() - startTime
+    if firstChunkTime == None:
+        firstChunkTime = renderTime
+
+    #The snapshots are made on one process while the workers render, so the render can never take less than snapshotTime
+    renderFps = framesRendered / renderTime if renderTime > 0 else 0
+    print("Rendered " + str(framesRendered) + " frames in " + ("%.2f" % renderTime) + "s on " + str(workers) + " processes, " + ("%.1f" % renderFps) + " fps, " + ("%.2f" % (renderFps / fps)) + "x real time")
+    print(("%.2f" % firstChunkTime) + "s to the first chunk, " + ("%.2f" % snapshotTime) + "s simulating the show on the main process for the chunk snapshots")
+
+    return {
+        "frames" : framesRendered,
+        "renderTime" : renderTime,
+        "firstChunkTime" : firstChunkTime,
+        "snapshotTime" : snapshotTime,
+        "fps" : renderFps,
+        "realTimeFactor" : renderFps / fps
+    }
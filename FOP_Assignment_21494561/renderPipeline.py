@@ -0,0 +1,158 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+#Parts of a frame the pipeline times, in the order they are reported
+pipelineStages = ["smoke", "movement", "lights", "objects", "composite"]
+
+#Draws the frames of a scene with the smoke, lights and objects worked out at the same time on a pool of threads
+#NumPy and cv2 let go of the GIL while they work, so the threads really do run at once
+#As soon as a frame is drawn the next frame's smoke is started, so it is simulated while the frame is shown or saved
+#The next frame's dt isn't known yet, so the smoke is moved by the last dt and any difference is made up on the step after
+#With a fixed dt every frame is the same as drawing it on one thread
+#Set on a scene with Scene.setPipeline, after which Scene.render and Scene.update use it
+class RenderPipeline:
+    def __init__(self, scene, workers = 3):
+        self.scene = scene
+        self.workers = max(1, workers)
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix = "render")
+
+        self.smokeFuture = None         #Smoke step started for the next frame
+        self.lastDt = 0                 #dt used to guess the next frame's dt
+        self.stageTime = 0.0            #Time the lights and objects have been moved on to
+        self.smokeTime = 0.0            #Time the smoke has been moved on to, including a step that has been started
+
+        self.frames = 0
+        self.frameTime = 0.0
+        self.stageTimes = {stageName : 0.0 for stageName in pipelineStages}
+        self.waitTimes = {stageName : 0.0 for stageName in pipelineStages}  #Time render spent waiting for each stage to finish
+
+    #Run one part of the frame on a worker thread, recording when it started and finished
+    def runStage(self, function, *arguments):
+        startTime = time.perf_counter()
+        result = function(*arguments)
+        return result, startTime, time.perf_counter()
+
+    def startStage(self, function, *arguments):
+        return self.executor.submit(self.runStage, function, *arguments)
+
+    #Wait for a part of the frame to finish and add it to the times of the frame
+    def finishStage(self, stageName, future):
+        waitStart = time.perf_counter()
+        result, startTime, endTime = future.result()
+        self.waitTimes[stageName] += time.perf_counter() - waitStart
+        self.addStageTime(stageName, startTime, endTime)
+        return result
+
+    def addStageTime(self, stageName, startTime, endTime):
+        self.stageTimes[stageName] += endTime - startTime
+        if self.scene.profiler != None:
+            self.scene.profiler.addStage(stageName, startTime, endTime)
+
+    #Move the smoke on and stretch it to the screen size, returning the smoke screen for the frame
+    def stepSmoke(self, dt):
+        scene = self.scene
+        scene.smoke.updateSmokeScreen(dt)
+        smokeBuffer = scene.smokeBuffer if scene.compositeMode != "float64" else None
+        return scene.getSmokeScreen(smokeBuffer)
+
+    #Start the smoke step for a frame dt seconds on, unless it was already started when the last frame was drawn
+    def startSmoke(self, dt):
+        self.stageTime += dt
+        if self.smokeFuture == None:
+            self.smokeTime += dt
+            self.smokeFuture = self.startStage(self.stepSmoke, dt)
+        future = self.smokeFuture
+        self.smokeFuture = None
+        return future
+
+    #Guess the next frame will take as long as the last one did and start its smoke step
+    #The smoke is never moved backwards, if it got ahead it waits until the rest of the stage catches up
+    def startNextSmoke(self, dt):
+        if dt > 0:
+            self.lastDt = dt
+        if self.lastDt == 0:
+            return
+
+        nextDt = max(0, self.lastDt + self.stageTime - self.smokeTime)
+        self.smokeTime += nextDt
+        self.smokeFuture = self.startStage(self.stepSmoke, nextDt)
+
+    #Move everything on the stage forward by dt seconds without drawing anything
+    def update(self, dt):
+        smokeFuture = self.startSmoke(dt)
+        startTime = time.perf_counter()
+        self.scene.updateMovement(dt)
+        self.addStageTime("movement", startTime, time.perf_counter())
+        self.finishStage("smoke", smokeFuture)
+
+    #Move the stage forward by dt seconds and draw it, giving the same frame as Scene.render
+    def render(self, dt):
+        scene = self.scene
+        profiler = scene.profiler
+        if profiler != None:
+            profiler.beginFrame()
+        frameStart = time.perf_counter()
+
+        #The smoke doesn't depend on the lights or objects, so it can already be running while they are moved
+        smokeFuture = self.startSmoke(dt)
+        startTime = time.perf_counter()
+        scene.updateMovement(dt)
+        self.addStageTime("movement", startTime, time.perf_counter())
+
+        lightsFuture = self.startStage(scene.getLightScreen)
+        objectsFuture = self.startStage(scene.getBackdrop)
+        smokeScreen = self.finishStage("smoke", smokeFuture)
+        lightScreen = self.finishStage("lights", lightsFuture)
+        backdrop = self.finishStage("objects", objectsFuture)
+
+        startTime = time.perf_counter()
+        output = scene.combineScreens(lightScreen, backdrop, smokeScreen)
+        self.addStageTime("composite", startTime, time.perf_counter())
+
+        self.startNextSmoke(dt)
+        self.frames += 1
+        self.frameTime += time.perf_counter() - frameStart
+        if profiler != None:
+            profiler.endFrame(scene)
+        return output
+
+    #Wait for the next frame's smoke step if one is running
+    #Anything it raised, such as the show ending, is raised by the next frame instead
+    def wait(self):
+        if self.smokeFuture != None:
+            self.smokeFuture.exception()
+
+    #Forget the next frame's smoke step, eg because a snapshot is about to replace the smoke
+    def reset(self):
+        self.wait()
+        self.smokeFuture = None
+        self.lastDt = 0
+        self.stageTime = 0.0
+        self.smokeTime = 0.0
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
+
+    #Average time of each stage and how much of it was hidden behind other stages or the caller, in milliseconds
+    #overlap is the total time of every stage over the time spent in render, above 1 when stages ran at the same time
+    def getStats(self):
+        stats = {"frames" : self.frames, "workers" : self.workers, "frameMs" : 0.0, "overlap" : 0.0}
+        if self.frames == 0:
+            return stats
+
+        stats["frameMs"] = self.frameTime / self.frames * 1000
+        stats["overlap"] = sum(self.stageTimes.values()) / self.frameTime if self.frameTime > 0 else 0.0
+        for stageName in pipelineStages:
+            stageTime = self.stageTimes[stageName]
+            stats[stageName + "Ms"] = stageTime / self.frames * 1000
+            stats[stageName + "Hidden"] = max(0.0, 1 - self.waitTimes[stageName] / stageTime) if stageTime > 0 and stageName not in ["movement", "composite"] else 0.0
+        return stats
+
+    def getSummaryText(self):
+        stats = self.getStats()
+        text = "Pipeline on " + str(stats["workers"]) + " threads, " + ("%.1f" % stats["frameMs"]) + " ms per frame, stages overlap " + ("%.2f" % stats["overlap"]) + "x"
+        for stageName in ["smoke", "lights", "objects"]:
+            if stageName + "Ms" in stats:
+                text += "\n  " + stageName + " " + ("%.1f" % stats[stageName + "Ms"]) + " ms, " + ("%.0f" % (100 * stats[stageName + "Hidden"])) + "% hidden"
+        return text
@@ -1,9 +1,9 @@
 import math
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import matplotlib.pyplot as plt
 import cv2
-from matplotlib.patches import Wedge, Polygon
-from matplotlib.collections import PatchCollection
 
 #Enables the render loop to be easily ended from anywhere in the program
 class end(Exception):
@@ -13,11 +13,258 @@ class end(Exception):
 def lerp(min, max, fraction):
     return min * (1 - fraction) + max * fraction
 
+#Returns the value of a 2d grid of vectors at each fractional position, bilinearly interpolating between the 4 surrounding cells
+#Positions outside the grid are clamped to the nearest edge cell
+def sampleField(field, positions):
+    maxIndex = np.array(field.shape[:2]) - 1
+    coordinates = np.clip(positions, 0, maxIndex)
+
+    lower = coordinates.astype(np.intp)
+    upper = np.minimum(lower + 1, maxIndex)
+    fraction = coordinates - lower
+    xFraction = fraction[:, 0:1]
+    yFraction = fraction[:, 1:2]
+
+    #Index the grid as a flat list of vectors as it is much faster than 2d fancy indexing
+    flatField = field.reshape(-1, field.shape[2])
+    lowerRow = lower[:, 0] * field.shape[1]
+    upperRow = upper[:, 0] * field.shape[1]
+
+    bottom = flatField.take(lowerRow + lower[:, 1], 0) * (1 - xFraction) + flatField.take(upperRow + lower[:, 1], 0) * xFraction
+    top = flatField.take(lowerRow + upper[:, 1], 0) * (1 - xFraction) + flatField.take(upperRow + upper[:, 1], 0) * xFraction
+    return bottom * (1 - yFraction) + top * yFraction
+
+#Whether a value read from a choreography sheet is blank
+def isBlank(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+#Read an image file the same way matplotlib does, with colors in red green blue order
+#PNG images are floats from 0 to 1, other formats keep their 8 bit values
+#cv2 is used so matplotlib does not have to be imported just to read images
+def readImage(imageLocation):
+    if not os.path.isfile(imageLocation):
+        raise FileNotFoundError(imageLocation)
+    
+    image = cv2.imread(imageLocation, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError("Could not read " + imageLocation)
+
+    if image.ndim == 3:
+        conversion = cv2.COLOR_BGRA2RGBA if image.shape[2] == 4 else cv2.COLOR_BGR2RGB
+        image = cv2.cvtColor(image, conversion)
+    if imageLocation.lower().endswith(".png"):
+        image = image.astype(np.float32) / np.float32(np.iinfo(image.dtype).max)
+    return image
+
+
+#A choreography sheet turned into keyframes when it is loaded, so the state at any time can be looked up without stepping through the instructions
+#Move To and Hold become keyframes, Loop To repeats the keyframes from the row looped to, Stop and End freeze the values
+class Timeline:
+    def __init__(self, instructionSet, valueNames, initialValues, stepName = None, initialStep = None):
+        self.valueNames = valueNames    #Columns that are interpolated between keyframes
+        self.stepName = stepName        #Column that changes at the start of each Move To instead of being interpolated
+
+        times = [0.0]
+        values = [np.array(initialValues, float)]
+        steps = []                      #Value of the step column during each keyframe interval
+        rowStarts = []                  #Keyframe each row starts at, used by Loop To
+        currentStep = initialStep
+
+        self.endTime = math.inf         #Time the whole show ends
+        self.stopTime = math.inf        #Time the values stop changing forever
+        self.loopStart = None           #Keyframe the loop goes back to
+
+        rows = self.getRows(instructionSet)
+        for rowIndex in range(0, len(rows["Instruction"])):
+            instruction = rows["Instruction"][rowIndex]
+            endTime = max(rows["End Time"][rowIndex], times[-1]) if not isBlank(rows["End Time"][rowIndex]) else times[-1]
+            rowStarts.append(len(times) - 1)
+
+            if instruction == "Move To":
+                targets = np.array([rows[valueName][rowIndex] for valueName in valueNames], float)
+                values.append(np.where(np.isnan(targets), values[-1], targets))
+                if stepName != None and not isBlank(rows[stepName][rowIndex]):
+                    currentStep = rows[stepName][rowIndex]
+            
+            elif instruction == "Loop To":
+                loopToIndex = rows["Loop To Index"][rowIndex]
+                if isBlank(loopToIndex) or int(loopToIndex) >= rowIndex or times[-1] <= times[rowStarts[int(loopToIndex)]]:
+                    self.stopTime = times[-1]
+                else:
+                    self.loopStart = rowStarts[int(loopToIndex)]
+                break
+
+            elif instruction == "Stop" or isBlank(instruction):
+                self.stopTime = times[-1]
+                break
+
+            elif instruction == "End":
+                self.stopTime = times[-1]
+                self.endTime = times[-1]
+                break
+
+            else:
+                #Hold, and anything not recognised, keeps the values until the end time
+                values.append(values[-1])
+
+            times.append(endTime)
+            steps.append(currentStep)
+
+        #A keyframe past the end so every time has an interval to fall in
+        times.append(math.inf)
+        values.append(values[-1])
+        steps.append(currentStep)
+
+        self.times = np.array(times)
+        self.values = np.array(values)
+        self.steps = steps
+
+        #When looping the first keyframe of the loop starts from wherever the values were when the loop was reached
+        if self.loopStart != None:
+            self.loopTime = self.times[-2]
+            self.loopPeriod = self.loopTime - self.times[self.loopStart]
+            self.loopTimes = self.times[self.loopStart:-1]
+            self.loopValues = self.values[self.loopStart:-1].copy()
+            self.loopValues[0] = self.values[-2]
+            self.loopSteps = self.steps[self.loopStart:-1]
+
+    #Returns every column of the instruction set as a list, with missing columns filled with blanks
+    def getRows(self, instructionSet):
+        columnNames = ["Instruction", "End Time", "Loop To Index"] + self.valueNames
+        if self.stepName != None:
+            columnNames.append(self.stepName)
+
+        if instructionSet is None:
+            return {columnName : [] for columnName in columnNames}
+
+        rowCount = len(instructionSet["Instruction"])
+        rows = {}
+        for columnName in columnNames:
+            if columnName in instructionSet:
+                rows[columnName] = list(instructionSet[columnName])
+            else:
+                rows[columnName] = [None] * rowCount
+        return rows
+
+    #Returns the interpolated values and the step value at a time since the start of the show
+    def getState(self, time):
+        times = self.times
+        values = self.values
+        steps = self.steps
+
+        if self.loopStart != None and time > self.loopTime:
+            time = self.loopTimes[0] + (time - self.loopTime) % self.loopPeriod
+            times = self.loopTimes
+            values = self.loopValues
+            steps = self.loopSteps
+
+        #Binary search for the keyframe interval the time is in, then interpolate across it
+        keyframe = min(max(int(np.searchsorted(times, time, "right")) - 1, 0), len(times) - 2)
+        duration = times[keyframe + 1] - times[keyframe]
+        if duration == math.inf:
+            fraction = 0.0
+        elif duration <= 0:
+            fraction = 1.0
+        else:
+            fraction = min(max((time - times[keyframe]) / duration, 0.0), 1.0)
+
+        return lerp(values[keyframe], values[keyframe + 1], fraction), steps[keyframe]
+
+    #Whether the values will never change again after time
+    #Anything that ends the show is never finished, it has to keep updating until it passes the end time and raises end
+    def isFinished(self, time):
+        return time >= self.stopTime and self.stopTime < self.endTime
+
+
+
+#Least recently used store of light cone masks, shared by every light so cones that repeat are only drawn once
+#Cones are looked up by their parameters rounded to the nearest step, so lights that are almost the same share a mask
+#Every mask is the size of the screen, so the cache is limited by memory as well as by the number of masks
+class LightConeCache:
+    def __init__(self, maxSize = 256, angleStep = 0.25, widthStep = 1.0, maxBytes = 64 * 2 ** 20):
+        self.maxSize = maxSize          #Maximum number of masks kept
+        self.maxBytes = maxBytes        #Memory the masks may use before the least recently used are removed
+        self.angleStep = angleStep      #Direction and spread angle are rounded to a multiple of this, in degrees
+        self.widthStep = widthStep      #Position and width are rounded to a multiple of this, in pixels
+
+        self.masks = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    #Returns the rounded light parameters used to store the cone
+    def getKey(self, xPosition, direction, spreadAngle, width, horizontalSize, verticalSize):
+        return (
+            round(xPosition / self.widthStep) * self.widthStep,
+            round(direction / self.angleStep) * self.angleStep,
+            round(spreadAngle / self.angleStep) * self.angleStep,
+            round(width / self.widthStep) * self.widthStep,
+            horizontalSize,
+            verticalSize
+        )
+
+    #Returns the mask stored under key, or None if it has not been drawn
+    def get(self, key):
+        mask = self.masks.get(key)
+        if mask is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.masks.move_to_end(key)
+        return mask
+
+    def put(self, key, mask):
+        mask.setflags(write=False)  #Masks are shared between lights so must not be edited
+        if key in self.masks:
+            self.bytes -= self.masks[key].nbytes
+        self.masks[key] = mask
+        self.masks.move_to_end(key)
+        self.bytes += mask.nbytes
+        self.evict()
+
+    #Remove the least recently used masks until the cache fits in maxSize and maxBytes, lights still using them keep their own reference
+    def evict(self):
+        while len(self.masks) > self.maxSize or (self.bytes > self.maxBytes and len(self.masks) > 1):
+            key, mask = self.masks.popitem(last=False)
+            self.bytes -= mask.nbytes
+            self.evictions += 1
+
+    def setMaxSize(self, maxSize):
+        self.maxSize = maxSize
+        self.evict()
+
+    def setMaxBytes(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.evict()
+
+    def clear(self):
+        self.masks.clear()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def getStats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits" : self.hits,
+            "misses" : self.misses,
+            "evictions" : self.evictions,
+            "size" : len(self.masks),
+            "bytes" : self.bytes,
+            "hitRate" : self.hits / lookups if lookups > 0 else 0.0
+        }
+
 
 
 class Light:
+    coneCache = LightConeCache()    #Cone masks shared by every light
+
     def __init__(self, xPosition, yPosition, direction, strength, spreadAngle, width, color, instructionSet, horizontalSize, verticalSize):
         self.position = np.array([xPosition, yPosition])
+        self.version = 0                    #Goes up every time the light looks different so anything drawn from it knows to redraw
+        self.direction = self.strength = self.spreadAngle = self.width = self.color = None
         self.setDirection(direction)        #angle in degrees, 0 = right, clockwise is negative
         self.setStrength(strength)          #Brightness of the light
         self.setSpreadAngle(spreadAngle)    #angle in degrees
@@ -25,8 +272,7 @@ class Light:
         self.setColor(color)                #Color of light as a string
 
         #Choreography instructions setup
-        self.instructionIndex = 0
-        self.instructionSet = instructionSet
+        self.timeline = Timeline(instructionSet, ["Direction", "Spread Angle", "Strength", "Width"], [direction, spreadAngle, strength, width], "Color", color)
         self.time = 0
         self.halted = False
 
@@ -34,34 +280,44 @@ class Light:
         self.horizontalSize = horizontalSize
         self.verticalSize = verticalSize
 
-        self.lightScreen = self.getNewLightScreen()
-
+        self.coneMask = self.getNewConeMask()
         self.changed = False
-    
-    def getNewLightScreen(self):
-        self.minVisibleAngle = self.direction - self.spreadAngle / 2
-        self.maxVisibleAngle = self.direction + self.spreadAngle / 2
-        
-        newLightScreen = np.zeros([self.horizontalSize, self.verticalSize, 3])
+
+    #Get the mask of every pixel the light cone reaches, drawing it only if it is not already in the cache
+    def getNewConeMask(self):
+        cache = Light.coneCache
+        key = cache.getKey(float(self.position[0]), self.direction, self.spreadAngle, self.width, self.horizontalSize, self.verticalSize)
+        mask = cache.get(key)
+        if mask is None:
+            mask = self.drawConeMask(*key[:4])
+            cache.put(key, mask)
+        return mask
+
+    #Returns a single channel mask that is True everywhere inside the light cone
+    def drawConeMask(self, xPosition, direction, spreadAngle, width):
+        minVisibleAngle = direction - spreadAngle / 2
+        maxVisibleAngle = direction + spreadAngle / 2
+
+        newConeMask = np.zeros([self.horizontalSize, self.verticalSize], bool)
         
         #Setup edges of light cone boundary
-        if self.minVisibleAngle <= -180:
+        if minVisibleAngle <= -180:
             leftEdge = 0
             leftStep = 0
         else:
-            leftEdge = float(self.position[0])
-            leftStep = 1 / math.tan(np.deg2rad(self.minVisibleAngle))
+            leftEdge = float(xPosition)
+            leftStep = 1 / math.tan(np.deg2rad(minVisibleAngle))
         
-        if self.maxVisibleAngle >= 0:
+        if maxVisibleAngle >= 0:
             rightEdge = self.horizontalSize
             rightStep = 0
         else:
-            rightEdge = float(self.position[0] + self.width)
-            rightStep = 1 / math.tan(np.deg2rad(self.maxVisibleAngle))
+            rightEdge = float(xPosition + width)
+            rightStep = 1 / math.tan(np.deg2rad(maxVisibleAngle))
 
-        #Loop through each row in the screen, setting relevant pixels to be the lights color
+        #Loop through each row in the screen, setting relevant pixels to be inside the cone
         for y in range(self.verticalSize - 1, -1, -1):
-            newLightScreen[int(leftEdge):int(rightEdge), y] = self.color
+            newConeMask[int(leftEdge):int(rightEdge), y] = True
             
             #Update boundaries for next iteration
             leftEdge -= leftStep
@@ -78,24 +334,35 @@ class Light:
             elif rightEdge <= 0:
                 break
         
-        return newLightScreen
+        return newConeMask
 
     def getColor(self):
         return self.color
     
     def getMinAngle(self):
-        return self.minVisibleAngle
+        return self.direction - self.spreadAngle / 2
     
     def getMaxAngle(self):
-        return self.maxVisibleAngle
+        return self.direction + self.spreadAngle / 2
     
     def getHorizontalPosition(self):
         return self.position[0]
+
+    #Position, direction, spread angle and width the cone mask is drawn from, rounded the same way as the cone cache
+    def getConeParameters(self):
+        return Light.coneCache.getKey(float(self.position[0]), self.direction, self.spreadAngle, self.width, self.horizontalSize, self.verticalSize)[:4]
     
-    def getLightScreen(self):
+    #Returns the mask of the light cone, only looking it up again if the cone has moved
+    def getConeMask(self):
         if self.changed:
-            self.lightScreen = self.getNewLightScreen()
-        return self.lightScreen
+            self.coneMask = self.getNewConeMask()
+            self.changed = False
+        return self.coneMask
+
+    #Add the light's color to every pixel of screen inside the light cone
+    #cv2 adds under a mask in place much faster than numpy, the bool mask is read as 8 bit without copying it
+    def addLightToScreen(self, screen):
+        cv2.add(screen, tuple(float(channel) for channel in self.color), dst=screen, mask=self.getConeMask().view(np.uint8))
     
     def getWidth(self):
         return self.width
@@ -112,76 +379,251 @@ class Light:
         }
 
         if color in colorDictionary:
-            self.color = colorDictionary[color]
+            newColor = colorDictionary[color]
         else:
             print("Error: Colour " + str(color) + " is invalid")
-            self.color = colorDictionary["white"]
+            newColor = colorDictionary["white"]
         
-        self.color *= self.strength / 11.0
+        newColor *= self.strength / 11.0
+        self.setColorValue(newColor)
 
-        self.changed = True
+    #Colors are only replaced when they are different, so a light holding its color isn't counted as changed
+    def setColorValue(self, color):
+        if self.color is None or not np.array_equal(color, self.color):
+            self.color = color
+            self.version += 1
 
+    #The setters only mark the light as changed when the value is different
+    #changed means the cone has to be looked up again, version goes up for anything that changes how the light looks
     def setDirection(self, direction):
-        self.direction = direction
-        self.changed = True
+        if direction != self.direction:
+            self.direction = direction
+            self.changed = True
+            self.version += 1
 
 
     def setWidth(self, width):
-        self.width = width
-        self.changed = True
+        if width != self.width:
+            self.width = width
+            self.changed = True
+            self.version += 1
 
     def setSpreadAngle(self, spreadAngle):
-        self.spreadAngle = spreadAngle
-        self.changed = True
+        if spreadAngle != self.spreadAngle:
+            self.spreadAngle = spreadAngle
+            self.changed = True
+            self.version += 1
 
+    #Strength only changes the light through its color, which is set after it
     def setStrength(self, strength):
         self.strength = strength
-        self.changed = True
+
+    #Returns everything needed to put the light back in its current state
+    def getSnapshot(self):
+        return {
+            "time" : self.time,
+            "halted" : self.halted,
+            "direction" : self.direction,
+            "spreadAngle" : self.spreadAngle,
+            "strength" : self.strength,
+            "width" : self.width,
+            "color" : self.color.copy()
+        }
+
+    def setSnapshot(self, snapshot):
+        self.time = snapshot["time"]
+        self.halted = snapshot["halted"]
+        self.setDirection(snapshot["direction"])
+        self.setSpreadAngle(snapshot["spreadAngle"])
+        self.setStrength(snapshot["strength"])
+        self.setWidth(snapshot["width"])
+        self.setColorValue(snapshot["color"].copy())
 
     #Update the light to follow the relevant instruction given by choreography
     def update(self, dt):
         #Instruction Set:Move to, Loop To(Row Index), Hold, Stop, End(Kills whole program)
         if self.halted == False:
             self.time += dt
-            
-            instruction = self.instructionSet.iloc[self.instructionIndex]
-            
-            if self.time > instruction.get("End Time"):
-                self.instructionIndex += 1# print(instruction)
-            
-            currentInstruction = instruction.get("Instruction")
-            if currentInstruction == None:
-                self.halted = True
-            
-            elif currentInstruction == "Move To":
-                remainingTime = instruction.get("End Time") - self.time
-                if remainingTime == 0:
-                    moveFraction = 1
-                else:
-                    moveFraction = min(dt / remainingTime, 1)
-                self.setColor(instruction.get("Color"))
-                self.setDirection(lerp(self.direction, instruction.get("Direction"), moveFraction))
-                self.setSpreadAngle(lerp(self.spreadAngle, instruction.get("Spread Angle"), moveFraction))
-                self.setStrength(lerp(self.strength, instruction.get("Strength"), moveFraction))
-                self.setWidth(lerp(self.width, instruction.get("Width"), moveFraction))
-
-            elif currentInstruction == "Loop To":
-                self.instructionIndex = int(instruction.get("Loop To Index"))
-                if self.instructionIndex == 0:
-                    self.time = 0
-                else:
-                    # print(instruction)
-                    self.time = instruction.get("End Time")
-            
-            elif currentInstruction == "Hold":
-                pass
-            
-            elif currentInstruction == "Stop":
-                self.halted = True
-            
-            elif currentInstruction == "End":
+            if self.time > self.timeline.endTime:
                 raise(end)
 
+            values, color = self.timeline.getState(self.time)
+            self.setDirection(values[0])
+            self.setSpreadAngle(values[1])
+            self.setStrength(values[2])
+            self.setWidth(values[3])
+            self.setColor(color)
+
+            self.halted = self.timeline.isFinished(self.time)
+
+
+
+#Draws every light on the stage in one pass instead of one light at a time
+#The edges of every cone are worked out for every row at once, then the light is added between the edges of each row
+class LightRasterizer:
+    def __init__(self, horizontalSize, verticalSize):
+        self.horizontalSize = horizontalSize
+        self.verticalSize = verticalSize
+        self.rowSteps = np.arange(verticalSize)    #Number of rows below the top of the screen
+
+    #Returns the left and right edges of every light cone in every row, from the top row down
+    #Rows the cone does not reach have equal edges
+    def getConeEdges(self, xPositions, directions, spreadAngles, widths):
+        minVisibleAngles = np.deg2rad(directions - spreadAngles / 2)[:, np.newaxis]
+        maxVisibleAngles = np.deg2rad(directions + spreadAngles / 2)[:, np.newaxis]
+        xPositions = xPositions[:, np.newaxis]
+        widths = widths[:, np.newaxis]
+
+        #Each edge moves sideways by a fixed step every row, horizontal edges are replaced below
+        with np.errstate(divide="ignore", invalid="ignore"):
+            leftSteps = 1 / np.tan(minVisibleAngles)
+            rightSteps = 1 / np.tan(maxVisibleAngles)
+            leftEdges = xPositions - self.rowSteps * leftSteps
+            rightEdges = xPositions + widths - self.rowSteps * rightSteps
+
+        #Once an edge reaches the side of the screen it stays there
+        leftEdges[:, 1:] = np.where(np.logical_or.accumulate(leftEdges[:, 1:] <= 0, 1), 0, leftEdges[:, 1:])
+        rightEdges[:, 1:] = np.where(np.logical_or.accumulate(rightEdges[:, 1:] >= self.horizontalSize, 1), self.horizontalSize, rightEdges[:, 1:])
+
+        #Cones that spread past horizontal fill the whole side of the screen
+        leftEdges = np.where(minVisibleAngles <= -np.pi, 0, leftEdges)
+        rightEdges = np.where(maxVisibleAngles >= 0, self.horizontalSize, rightEdges)
+
+        #Once the cone has left the screen no more rows are drawn
+        visibleRows = np.ones(leftEdges.shape, bool)
+        visibleRows[:, 1:] = np.logical_and.accumulate((leftEdges[:, 1:] < self.horizontalSize) & (rightEdges[:, 1:] > 0), 1)
+
+        leftEdges = np.clip(leftEdges, 0, self.horizontalSize).astype(np.intp)
+        rightEdges = np.clip(rightEdges, 0, self.horizontalSize).astype(np.intp)
+        rightEdges = np.where(visibleRows, np.maximum(leftEdges, rightEdges), leftEdges)
+        return leftEdges, rightEdges
+
+    #Returns the combined light screen of every light in lights, drawn into lightScreen if it is given
+    def getLightScreen(self, lights, lightScreen = None):
+        if lightScreen is None:
+            lightScreen = np.zeros([self.horizontalSize, self.verticalSize, 3])
+        if len(lights) == 0:
+            lightScreen.fill(0)
+            return lightScreen
+
+        xPositions = np.array([light.getHorizontalPosition() for light in lights], float)
+        directions = np.array([light.direction for light in lights], float)
+        spreadAngles = np.array([light.spreadAngle for light in lights], float)
+        widths = np.array([light.getWidth() for light in lights], float)
+        colors = np.array([light.getColor() for light in lights], float)
+        leftEdges, rightEdges = self.getConeEdges(xPositions, directions, spreadAngles, widths)
+
+        #Mark where the light starts and stops in each row, then a running sum along each row fills the cone in between
+        rows = self.verticalSize - 1 - self.rowSteps
+        edgeIndices = np.concatenate([leftEdges * self.verticalSize + rows, rightEdges * self.verticalSize + rows]).ravel()
+        edgeIndices = (edgeIndices[:, np.newaxis] * 3 + np.arange(3)).ravel()
+        edgeColors = np.repeat(colors, self.verticalSize, 0)
+        edgeColors = np.concatenate([edgeColors, -edgeColors]).ravel()
+
+        edgeChanges = np.bincount(edgeIndices, edgeColors, (self.horizontalSize + 1) * self.verticalSize * 3)
+        edgeChanges = edgeChanges.reshape([self.horizontalSize + 1, self.verticalSize, 3])
+        np.cumsum(edgeChanges[:-1], 0, out=lightScreen)
+
+        return lightScreen
+
+#Combines the screens one square tile at a time, only doing the work for tiles a light cone reaches
+#Every part of the frame is multiplied by the light, so tiles no light reaches are black and are only cleared when they go dark
+#Lit tiles next to each other are combined into blocks, and with more than one worker the blocks are shared between threads
+class TiledCompositor:
+    def __init__(self, horizontalSize, verticalSize, tileSize = 32, workers = 1):
+        self.horizontalSize = horizontalSize
+        self.verticalSize = verticalSize
+        self.tileSize = max(1, int(tileSize))
+        self.tileColumns = math.ceil(horizontalSize / self.tileSize)
+        self.tileRows = math.ceil(verticalSize / self.tileSize)
+        self.rows = verticalSize - 1 - np.arange(verticalSize)     #Screen row of each row of cone edges, from the top down
+
+        self.workers = max(1, workers)
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix = "tiles") if self.workers > 1 else None
+
+        self.litTiles = np.zeros([self.tileColumns, self.tileRows], bool)  #Tiles drawn last frame, everything else in the output is already black
+        self.frames = 0
+        self.skippedTiles = 0
+        self.lastSkippedFraction = 0.0
+
+    #Mark every tile that any row of any cone reaches
+    #Edges are widened by a pixel so cones drawn from the cone cache, which are worked out slightly differently, are always inside a marked tile
+    def getLitTiles(self, leftEdges, rightEdges):
+        visible = rightEdges > leftEdges
+        tileRows = self.rows[np.nonzero(visible)[1]] // self.tileSize
+        startColumns = np.maximum(leftEdges[visible] - 1, 0) // self.tileSize
+        endColumns = np.minimum(rightEdges[visible], self.horizontalSize - 1) // self.tileSize + 1
+
+        #Mark where each row of tiles starts and stops being lit, then a running sum fills in between
+        rowLength = self.tileColumns + 1
+        changes = np.bincount(tileRows * rowLength + startColumns, None, self.tileRows * rowLength)
+        changes -= np.bincount(tileRows * rowLength + endColumns, None, self.tileRows * rowLength)
+        litTiles = np.cumsum(changes.reshape([self.tileRows, rowLength])[:, :-1], 1) > 0
+        return litTiles.T
+
+    #Screen slices of the marked tiles, as blocks that are as tall as possible
+    #Screens are stored a column at a time, so tall blocks keep the work on long stretches of memory
+    #Columns of tiles next to each other that are marked the same way share their blocks
+    def getRuns(self, tiles):
+        runs = []
+        tileSize = self.tileSize
+        groupStarts = np.flatnonzero(np.concatenate([[True], np.any(tiles[1:] != tiles[:-1], 1)]))
+        groupEnds = np.append(groupStarts[1:], self.tileColumns)
+        for groupStart, groupEnd in zip(groupStarts, groupEnds):
+            columns = slice(groupStart * tileSize, min(groupEnd * tileSize, self.horizontalSize))
+            changes = np.flatnonzero(np.diff(tiles[groupStart], prepend=False, append=False))
+            for start, stop in zip(changes[::2], changes[1::2]):
+                runs.append((columns, slice(start * tileSize, min(stop * tileSize, self.verticalSize))))
+        return runs
+
+    def forEachRun(self, function, runs):
+        if self.executor == None or len(runs) < 2:
+            return [function(run) for run in runs]
+        return list(self.executor.map(function, runs))
+
+    #Light the smoke and backdrop into output, only in tiles marked in litTiles, and clear tiles that have gone dark since the last frame
+    #getSmokeScreen is only called if a tile is lit, so the smoke isn't stretched to the screen size for a dark frame
+    def composite(self, lightScreen, backdrop, getSmokeScreen, output, litTiles, normalise):
+        for run in self.getRuns(self.litTiles & ~litTiles):
+            output[run].fill(0)
+
+        runs = self.getRuns(litTiles)
+        if len(runs) > 0:
+            smokeScreen = getSmokeScreen()[:, :, np.newaxis]
+
+            #Same steps as Scene.combineScreensInPlace on a part of the screen
+            def blendRun(run):
+                runOutput = output[run]
+                runBackdrop = backdrop[run]
+                np.subtract(1, runBackdrop, out=runOutput)
+                runOutput *= smokeScreen[run]
+                runOutput += runBackdrop
+                runOutput *= lightScreen[run]
+                return runOutput.max() if normalise else 0
+
+            brightest = max(self.forEachRun(blendRun, runs))
+            if brightest > 1:
+                for run in runs:
+                    output[run] /= brightest
+
+        litCount = np.count_nonzero(litTiles)
+        self.litTiles = litTiles
+        self.frames += 1
+        self.skippedTiles += litTiles.size - litCount
+        self.lastSkippedFraction = 1 - litCount / litTiles.size
+        return output
+
+    def getStats(self):
+        tileCount = self.tileColumns * self.tileRows
+        return {
+            "tileSize" : self.tileSize,
+            "tiles" : tileCount,
+            "workers" : self.workers,
+            "frames" : self.frames,
+            "skippedFraction" : self.skippedTiles / (self.frames * tileCount) if self.frames > 0 else 0.0,
+            "lastSkippedFraction" : self.lastSkippedFraction
+        }
+
 
 
 class smokeMachine:
@@ -192,10 +634,9 @@ class smokeMachine:
         self.setSpeed(speed)
 
         #Choreography setup
-        self.instructionSet = instructionSet
+        self.timeline = Timeline(instructionSet, ["Direction", "Strength", "Speed"], [direction, strength, speed])
         self.halted = False
         self.time = 0
-        self.instructionIndex = 0
     
     def getNewSmoke(self):
         #Smoke[0] is positions
@@ -225,49 +666,211 @@ class smokeMachine:
     def setSpeed(self, speed):
         self.speed = speed
     
+    #Returns everything needed to put the smoke machine back in its current state
+    def getSnapshot(self):
+        return {
+            "time" : self.time,
+            "halted" : self.halted,
+            "direction" : self.direction,
+            "strength" : self.strength,
+            "speed" : self.speed
+        }
+
+    def setSnapshot(self, snapshot):
+        self.time = snapshot["time"]
+        self.halted = snapshot["halted"]
+        self.setDirection(snapshot["direction"])
+        self.setStrength(snapshot["strength"])
+        self.setSpeed(snapshot["speed"])
+    
     #Update the smoke machine to follow the relevant instruction given by choreography
     def update(self, dt):
         #Instruction Set:Move to, Loop To(Row Index), Hold, Stop, End(Kills whole program)
         if self.halted == False:
             self.time += dt
-
-            instruction = self.instructionSet.iloc[self.instructionIndex]
-            if self.time > instruction.get("End Time"):
-                self.instructionIndex += 1          
-            
-            currentInstruction = instruction.get("Instruction")
-            if currentInstruction == None:
-                self.halted = True
-            
-            elif currentInstruction == "Move To":
-                remainingTime = instruction.get("End Time") - self.time
-                if remainingTime == 0:
-                    moveFraction = 1
-                else:
-                    moveFraction = min(dt / remainingTime, 1)
-                self.setDirection(lerp(self.direction, instruction.get("Direction"), moveFraction))
-                self.setStrength(lerp(self.strength, instruction.get("Strength"), moveFraction))
-                self.setSpeed(lerp(self.speed, instruction.get("Speed"), moveFraction))
-
-            elif currentInstruction == "Loop To":
-                self.instructionIndex = int(instruction.get("Loop To Index"))
-                if self.instructionIndex == 0:
-                    self.time = 0
-                else:
-                    self.time = instruction.get("End Time").get(self.instructionIndex - 1)
-            
-            elif currentInstruction == "Hold":
-                pass
-            
-            elif currentInstruction == "Stop":
-                self.halted = True
-            
-            elif currentInstruction == "End":
+            if self.time > self.timeline.endTime:
                 raise(end)
 
+            values, step = self.timeline.getState(self.time)
+            self.setDirection(values[0])
+            self.setStrength(values[1])
+            self.setSpeed(values[2])
+
+            self.halted = self.timeline.isFinished(self.time)
+
+#Fixed size storage for smoke particles, stored as one array per property
+#Only the first count entries are live, dead particles are compacted away in place so the arrays are never reallocated
+class ParticlePool:
+    def __init__(self, capacity, overflowPolicy = "drop oldest"):
+        if overflowPolicy not in ["drop oldest", "refuse"]:
+            raise ValueError("Overflow policy " + str(overflowPolicy) + " is invalid")
+
+        self.capacity = int(capacity)
+        self.overflowPolicy = overflowPolicy    #What to do with new particles once the pool is full
+        self.count = 0
+        self.dropped = 0                        #Number of particles lost because the pool was full
+
+        self.positions = np.zeros([self.capacity, 2])
+        self.velocities = np.zeros([self.capacity, 2])
+        self.intensities = np.zeros([self.capacity])
+        self.births = np.zeros([self.capacity], np.int64)  #Spawn order of each particle, used to find the oldest
+        self.nextBirth = 0
+
+    def getPositions(self):
+        return self.positions[:self.count]
+
+    def getVelocities(self):
+        return self.velocities[:self.count]
+
+    def getIntensities(self):
+        return self.intensities[:self.count]
+
+    #Add new particles at full intensity, following the overflow policy if there is not enough room
+    def spawn(self, positions, velocities):
+        newCount = min(len(positions), self.capacity)
+        self.dropped += len(positions) - newCount
+        freeSpace = self.capacity - self.count
+
+        if newCount <= freeSpace:
+            slots = slice(self.count, self.count + newCount)
+            self.count += newCount
+        elif self.overflowPolicy == "refuse":
+            self.dropped += newCount - freeSpace
+            newCount = freeSpace
+            slots = slice(self.count, self.capacity)
+            self.count = self.capacity
+        else:
+            #Overwrite the oldest particles with the ones that do not fit
+            overflow = newCount - freeSpace
+            oldest = np.argpartition(self.births[:self.count], overflow - 1)[:overflow]
+            slots = np.concatenate([oldest, np.arange(self.count, self.capacity)])
+            self.dropped += overflow
+            self.count = self.capacity
+
+        self.positions[slots] = positions[:newCount]
+        self.velocities[slots] = velocities[:newCount]
+        self.intensities[slots] = 1.0
+        self.births[slots] = self.nextBirth
+        self.nextBirth += 1
+
+    #Returns copies of every live particle so the pool can be put back in its current state
+    def getSnapshot(self):
+        return {
+            "positions" : self.getPositions().copy(),
+            "velocities" : self.getVelocities().copy(),
+            "intensities" : self.getIntensities().copy(),
+            "births" : self.births[:self.count].copy(),
+            "nextBirth" : self.nextBirth,
+            "dropped" : self.dropped
+        }
+
+    def setSnapshot(self, snapshot):
+        self.count = min(len(snapshot["positions"]), self.capacity)
+        self.positions[:self.count] = snapshot["positions"][:self.count]
+        self.velocities[:self.count] = snapshot["velocities"][:self.count]
+        self.intensities[:self.count] = snapshot["intensities"][:self.count]
+        self.births[:self.count] = snapshot["births"][:self.count]
+        self.nextBirth = snapshot["nextBirth"]
+        self.dropped = snapshot["dropped"]
+
+    #Remove every particle where alive is False by moving live particles from the end of the pool into the gaps
+    def compact(self, alive):
+        deadIndices = np.flatnonzero(~alive)
+        newCount = self.count - len(deadIndices)
+
+        gaps = deadIndices[deadIndices < newCount]
+        movers = newCount + np.flatnonzero(alive[newCount:])
+        for array in [self.positions, self.velocities, self.intensities, self.births]:
+            array[gaps] = array[movers]
+
+        self.count = newCount
+
+#A velocity field that changes smoothly over time and repeats every period seconds
+#It is the curl of smooth noise, so it swirls without bunching the smoke up or thinning it out anywhere
+#The field is stored as slices through time on a grid with cells cellSize pixels apart, each frame only blends the two slices either side of the time
+#With a cache directory the volume is saved as a .npy file and later read straight from the disk as it is needed
+class FlowVolume:
+    def __init__(self, horizontalSize, verticalSize, period = 20.0, sliceCount = 64, cellSize = 8, featureSize = 80, flowSpeed = 200 / math.sqrt(3), seed = 0, cacheDirectory = None):
+        if not period > 0:
+            raise ValueError("Flow period " + str(period) + " is invalid, it must be more than 0 seconds")
+
+        self.horizontalSize = horizontalSize
+        self.verticalSize = verticalSize
+        self.period = period
+        self.sliceCount = sliceCount
+        self.cellSize = cellSize
+        self.gridHorizontalSize = math.ceil(horizontalSize / cellSize) + 1
+        self.gridVerticalSize = math.ceil(verticalSize / cellSize) + 1
+        shape = (sliceCount, self.gridHorizontalSize, self.gridVerticalSize, 2)
+
+        self.velocityScreen = np.zeros(shape[1:], np.float32)  #Blend of the slices at the current time
+        self.volume = None
+
+        cacheLocation = None
+        if cacheDirectory != None:
+            cacheName = str(horizontalSize) + "x" + str(verticalSize) + "-p" + str(period) + "-s" + str(sliceCount) + "-c" + str(cellSize) + "-f" + str(featureSize) + "-v" + ("%.3f" % flowSpeed) + "-" + str(seed) + ".flow.npy"
+            cacheLocation = os.path.join(cacheDirectory, cacheName)
+            if os.path.isfile(cacheLocation):
+                try:
+                    volume = np.load(cacheLocation, mmap_mode="r")
+                    if volume.shape == shape and volume.dtype == np.float32:
+                        self.volume = volume
+                except (OSError, ValueError):
+                    print("Flow volume " + cacheLocation + " is invalid, making it again")
+
+        if self.volume is None and cacheLocation != None:
+            try:
+                #Written to a temporary file first so a process reading the cache never sees half of it
+                temporaryLocation = cacheLocation + "." + str(os.getpid()) + ".tmp"
+                volume = np.lib.format.open_memmap(temporaryLocation, "w+", np.float32, shape)
+                self.fillVolume(volume, featureSize, flowSpeed, seed)
+                volume.flush()
+                del volume
+                os.replace(temporaryLocation, cacheLocation)
+                self.volume = np.load(cacheLocation, mmap_mode="r")
+            except OSError:
+                print("Could not save flow volume " + cacheLocation)
+
+        if self.volume is None:
+            self.volume = np.zeros(shape, np.float32)
+            self.fillVolume(self.volume, featureSize, flowSpeed, seed)
+
+    #Fill the volume with the curl of noise that is smooth across the screen and through time
+    #Noise is only kept for a few cycles per period, so the slices wrap around from the last back to the first without a jump
+    def fillVolume(self, volume, featureSize, flowSpeed, seed, cyclesPerPeriod = 3):
+        random = np.random.RandomState(seed)
+        noiseHorizontalSize = max(2, round(self.horizontalSize / featureSize)) + 1
+        noiseVerticalSize = max(2, round(self.verticalSize / featureSize)) + 1
+        noise = random.normal(size = [self.sliceCount, noiseHorizontalSize, noiseVerticalSize])
+
+        spectrum = np.fft.rfft(noise, axis=0)
+        spectrum[cyclesPerPeriod + 1:] = 0
+        noise = np.fft.irfft(spectrum, self.sliceCount, axis=0).astype(np.float32)
+
+        squareSum = 0.0
+        for i in range(self.sliceCount):
+            potential = cv2.resize(noise[i], [self.gridVerticalSize, self.gridHorizontalSize], interpolation=cv2.INTER_CUBIC)
+            volume[i, :, :, 0] = np.gradient(potential, axis=1)
+            volume[i, :, :, 1] = -np.gradient(potential, axis=0)
+            squareSum += float(np.square(volume[i], dtype=np.float64).sum())
+
+        #Scale the flow to the same average speed as the random velocity screen
+        volume *= flowSpeed / math.sqrt(squareSum / volume.size)
+
+    #Blend the two slices either side of time into the velocity screen
+    def getVelocityScreen(self, time):
+        position = (time % self.period) / self.period * self.sliceCount
+        lowerSlice = int(position) % self.sliceCount
+        upperSlice = (lowerSlice + 1) % self.sliceCount
+        fraction = position - int(position)
+        cv2.addWeighted(self.volume[lowerSlice], 1 - fraction, self.volume[upperSlice], fraction, 0, dst=self.velocityScreen)
+        return self.velocityScreen
+
 #Handles all the smoke machines and particles
+#Smoke only changes slowly across the screen, so it can be simulated on a grid smokeScale times smaller than the screen
+#Particles and smoke machines still use screen positions, only the smoke screen and velocity screen are smaller
 class SmokeScreen:
-    def __init__(self, horizontalSize, verticalSize, baseSmoke):
+    def __init__(self, horizontalSize, verticalSize, baseSmoke, particleCapacity = 200000, overflowPolicy = "drop oldest", smokeScale = 1):
         self.baseSmoke = baseSmoke      #The amount of smoke everywhere
         self.particleSize = 10
         self.smokeMachines = []
@@ -275,25 +878,68 @@ class SmokeScreen:
         #Screen information
         self.horizontalSize = horizontalSize
         self.verticalSize = verticalSize
-        self.smokeScreen = np.zeros([horizontalSize, verticalSize]) + baseSmoke
 
+        #Size of the grid the smoke is simulated on
+        self.smokeScale = smokeScale
+        self.gridHorizontalSize = math.ceil(horizontalSize / smokeScale)
+        self.gridVerticalSize = math.ceil(verticalSize / smokeScale)
+        self.smokeScreen = np.zeros([self.gridHorizontalSize, self.gridVerticalSize]) + baseSmoke
 
-        self.smokeParticlePositions = np.array([[]])
-        self.smokeParticleVelocities = np.array([[]])
-        self.smokeParticleIntensities = np.array([])
+
+        self.particles = ParticlePool(particleCapacity, overflowPolicy)
 
         self.velocityScreen = self.getNewVelocityScreen()
+        self.velocityScale = smokeScale     #Pixels between cells of the velocity screen
+        self.flowVolume = None              #Changes the velocity screen over time when set
+        self.time = 0.0
+        self.profiler = None                #Set by the scene when frames are being profiled
+
+        #Goes up every time the smoke screen changes, while there is no smoke apart from the base smoke it stays the same
+        self.version = 0
+        self.settled = False                #True once the smoke screen is only the base smoke
 
     
     def addSmokeMachine(self, position, strength, direction, speed, instructionSet):
         self.smokeMachines.append(smokeMachine(position, strength, direction, speed, instructionSet))
     
     def getSmoke(self, location):
-        return self.smokeScreen[location[0]][location[1]]
+        return self.smokeScreen[int(location[0] / self.smokeScale)][int(location[1] / self.smokeScale)]
     
     def getSmokeScreen(self):
         return self.smokeScreen
 
+    #Have the smoke follow a FlowVolume that changes over time instead of the fixed random velocity screen
+    def setFlowVolume(self, flowVolume):
+        self.flowVolume = flowVolume
+        self.velocityScale = flowVolume.cellSize
+        self.velocityScreen = flowVolume.getVelocityScreen(self.time)
+
+    #Move the time on and blend the velocity screen for it from the flow volume
+    def updateFlow(self, dt):
+        self.time += dt
+        if self.flowVolume != None:
+            self.velocityScreen = self.flowVolume.getVelocityScreen(self.time)
+
+    #Returns everything needed to put the smoke back in its current state
+    def getSnapshot(self):
+        return {
+            "time" : self.time,
+            "smokeScreen" : self.smokeScreen.copy(),
+            "velocityScreen" : self.velocityScreen.copy(),
+            "particles" : self.particles.getSnapshot(),
+            "smokeMachines" : [smokeMachine.getSnapshot() for smokeMachine in self.smokeMachines]
+        }
+
+    def setSnapshot(self, snapshot):
+        self.time = snapshot["time"]
+        self.smokeScreen = snapshot["smokeScreen"].copy()
+        self.version += 1
+        self.settled = False
+        self.velocityScreen = snapshot["velocityScreen"].copy()
+        self.particles.setSnapshot(snapshot["particles"])
+        for smokeMachine, smokeMachineSnapshot in zip(self.smokeMachines, snapshot["smokeMachines"]):
+            smokeMachine.setSnapshot(smokeMachineSnapshot)
+
     #The velocity screen is the map of movements that the particles slowly follow
     def getNewVelocityScreen(self):
         rescaleFactor = 80
@@ -301,83 +947,229 @@ class SmokeScreen:
         velocityScreen = np.random.random([int(self.horizontalSize / rescaleFactor), int(self.verticalSize / rescaleFactor), 2])
         
         #Stretch the map out to smoothly interpolate between neighbouring points so particles flow in general patters
-        velocityScreen = cv2.resize(velocityScreen, [self.verticalSize, self.horizontalSize])[:, :, :2] * 2 - 1
+        velocityScreen = cv2.resize(velocityScreen, [self.gridVerticalSize, self.gridHorizontalSize])[:, :, :2] * 2 - 1
         velocityScreen *= 200
 
         return velocityScreen
     
+    #Move every particle through the velocity map, fading its intensity as it goes
+    def advectParticles(self, dt):
+        positions = self.particles.getPositions()
+        velocities = self.particles.getVelocities()
+
+        #Have the particle slowly lose intensity as it "difuses"
+        particleLife = 10.0
+        self.particles.getIntensities()[:] -= dt / particleLife
+
+        velocityRetention = 0.94    #How much velocity is retained from previous frame
+        velocityRandom = 0.005       #How much velocity is randomly generated
+
+        velocities *= velocityRetention
+        velocities += 20 *  velocityRandom * np.random.normal(size = velocities.shape)
+
+        #Update all velocities based on velocity map
+        velocities += (1 - velocityRetention - velocityRandom) * sampleField(self.velocityScreen, positions / self.velocityScale)
+
+        #Move the particles
+        positions += velocities * dt
+
+    #Returns a boolean mask of the particles that are still on screen and visible
+    def getSurvivingParticles(self):
+        positions = self.particles.getPositions()
+        return (positions.min(1) >= 0) & (positions[:, 0] <= self.horizontalSize) & (positions[:, 1] <= self.verticalSize) & (self.particles.getIntensities() > 0)
+
     #Move all the particles and get a new smoke level output
     def updateSmokeScreen(self, dt):
+        profiler = self.profiler
+        if profiler != None:
+            startTime = profiler.startStage()
+
+        self.updateFlow(dt)
         for smokeMachine in self.smokeMachines:
             smokeMachine.update(dt)
-        
 
-        if self.smokeParticlePositions.size != 0:
-            #Have the particle slowly lose intensity as it "difuses"
-            particleLife = 10.0
-            self.smokeParticleIntensities -= dt / particleLife
-            
-            #if particles exist move particles
-            velocityRetention = 0.94    #How much velocity is retained from previous frame
-            velocityRandom = 0.005       #How much velocity is randomly generated
-            
-            self.smokeParticleVelocities *= velocityRetention
-            self.smokeParticleVelocities += 20 *  velocityRandom * np.random.normal(size = self.smokeParticleVelocities.shape)
+        #if particles exist move particles
+        if self.particles.count > 0:
+            self.advectParticles(dt)
+        if profiler != None:
+            startTime = profiler.endStage("advect", startTime)
 
-            #Update all velocities based on velocity map
-            for i in range(0, len(self.smokeParticlePositions)):
-                position = self.smokeParticlePositions[i].astype(int)
-                self.smokeParticleVelocities[i] += (1 - velocityRetention -velocityRandom) * self.velocityScreen[position[0], position[1]]
-            
-            #Move the particles
-            self.smokeParticlePositions += self.smokeParticleVelocities * dt
+        #Create new particles
+        for smokeMachine in self.smokeMachines:
+            newSmokeParticles = smokeMachine.getNewSmoke()
+            self.particles.spawn(newSmokeParticles[0], newSmokeParticles[1])
+
+        #Remove illegal particles
+        if self.particles.count > 0:
+            self.particles.compact(self.getSurvivingParticles())
+        if profiler != None:
+            startTime = profiler.endStage("spawn", startTime)
+
+        #With no particles the smoke screen is only the base smoke, which is already there if there were none last step either
+        if self.particles.count > 0 or not self.settled:
+            self.smokeScreen = self.depositParticles(self.particles.getPositions(), self.particles.getIntensities())
+            self.settled = self.particles.count == 0
+            self.version += 1
+        if profiler != None:
+            profiler.endStage("deposit", startTime)
+
+    #Turn the particles into a smoke level for every cell of the smoke grid
+    def depositParticles(self, positions, intensities):
+        #Particles and the blur are shrunk to the grid, a particle smaller than a cell is added to one cell with the same total smoke
+        particleSize = max(1, round(self.particleSize / self.smokeScale))
+        particleWeight = (self.particleSize / self.smokeScale) ** 2 / particleSize ** 2
+        paddedHorizontalSize = self.gridHorizontalSize + 2 * particleSize
+        paddedVerticalSize = self.gridVerticalSize + 2 * particleSize
+
+        #Sum the intensity of every particle into the cell its corner lies in with a single weighted histogram
+        if self.smokeScale != 1:
+            positions = positions / self.smokeScale
+        cells = positions.astype(np.intp)
+        cellIndices = cells[:, 0] * paddedVerticalSize + cells[:, 1]
+        newSmokeScreen = np.bincount(cellIndices, intensities, paddedHorizontalSize * paddedVerticalSize)
+        newSmokeScreen = newSmokeScreen.reshape([paddedHorizontalSize, paddedVerticalSize]).astype(np.float64, copy=False)
+        if particleWeight != 1:
+            newSmokeScreen *= particleWeight
+
+        #Spread each particle over a particleSize square, the box filter sums every cell in the square ending at each cell
+        anchor = [particleSize - 1, particleSize - 1]
+        newSmokeScreen = cv2.boxFilter(newSmokeScreen, -1, [particleSize, particleSize], anchor=anchor, normalize=False, borderType=cv2.BORDER_CONSTANT)
+        newSmokeScreen += self.baseSmoke
 
-            #Create new particles
-            for smokeMachine in self.smokeMachines:
-                newSmokeParticles = smokeMachine.getNewSmoke()
+        #Diffuse the smoke with moore neighbourhoods
+        blurSize = max(1, round(40 / self.smokeScale))
+        newSmokeScreen = cv2.blur(newSmokeScreen[particleSize:-particleSize, particleSize:-particleSize], [blurSize, blurSize])
+        return np.clip(newSmokeScreen, 0, 1)
+
+#Smoke engine that stores smoke as a density on a grid instead of as particles
+#Smoke is moved around the grid by the velocity screen, so the cost only depends on the size of the screen, not on how much smoke there is
+class GridSmokeScreen(SmokeScreen):
+    def __init__(self, horizontalSize, verticalSize, baseSmoke, smokeScale = 1):
+        super().__init__(horizontalSize, verticalSize, baseSmoke, particleCapacity = 0, smokeScale = smokeScale)
+
+        self.density = np.zeros([self.gridHorizontalSize, self.gridVerticalSize], np.float32)
+        #Velocity of smoke fired out of the machines, fades away leaving the smoke to drift with the velocity screen
+        #Velocities are in screen pixels per second like the particle engine, not grid cells
+        self.jetVelocity = np.zeros([self.gridHorizontalSize, self.gridVerticalSize, 2], np.float32)
+
+        #Coordinates of every cell, used to trace back where the smoke in each cell came from
+        self.cellRows, self.cellColumns = np.meshgrid(np.arange(self.gridHorizontalSize, dtype=np.float32), np.arange(self.gridVerticalSize, dtype=np.float32), indexing="ij")
+
+        #Particles end up drifting at a fraction of the velocity screen, so the grid is moved at that fraction
+        self.driftFactor = 0.055 / 0.06
+        self.driftVelocity = (self.driftFactor * self.velocityScreen).astype(np.float32)
+
+    def getSnapshot(self):
+        snapshot = super().getSnapshot()
+        snapshot["density"] = self.density.copy()
+        snapshot["jetVelocity"] = self.jetVelocity.copy()
+        snapshot["driftVelocity"] = self.driftVelocity.copy()
+        return snapshot
+
+    def setSnapshot(self, snapshot):
+        super().setSnapshot(snapshot)
+        self.density = snapshot["density"].copy()
+        self.jetVelocity = snapshot["jetVelocity"].copy()
+        self.driftVelocity = snapshot["driftVelocity"].copy()
+
+    #The flow volume is on its own grid, so it is resampled onto the smoke grid every time it changes
+    def updateFlow(self, dt):
+        super().updateFlow(dt)
+        if self.flowVolume != None:
+            flowScale = self.smokeScale / self.flowVolume.cellSize
+            cv2.remap(self.velocityScreen, self.cellColumns * flowScale, self.cellRows * flowScale, cv2.INTER_LINEAR, dst=self.driftVelocity, borderMode=cv2.BORDER_REPLICATE)
+            self.driftVelocity *= self.driftFactor
+
+    #Add smoke and jet velocity in a square around every smoke machine, returns True if any smoke was added
+    def injectSmoke(self, dt):
+        positionSpread = 20     #Size of the square smoke is added to
+        angleSpread = 15.0      #Matches the spread of particles from a machine
+        injectionRate = 7.5     #Density added to each cell per second per unit of strength
+
+        injected = False
+        for smokeMachine in self.smokeMachines:
+            if smokeMachine.strength <= 0:
+                continue
+            injected = True
 
-                self.smokeParticlePositions = np.append(self.smokeParticlePositions, newSmokeParticles[0], 0)
-                self.smokeParticleVelocities = np.append(self.smokeParticleVelocities, newSmokeParticles[1], 0)
-                self.smokeParticleIntensities = np.append(self.smokeParticleIntensities, np.ones([newSmokeParticles.shape[1]]))
-        else:
-            #if no particles exist create new particles
-            for smokeMachine in self.smokeMachines:
-                newSmokeParticles = smokeMachine.getNewSmoke()
-
-                self.smokeParticlePositions = newSmokeParticles[0]
-                self.smokeParticleVelocities = newSmokeParticles[1]
-                self.smokeParticleIntensities = np.ones([newSmokeParticles.shape[1]])
-
-
-        newSmokeScreen = np.zeros([self.horizontalSize + 2 * self.particleSize, self.verticalSize + 2 * self.particleSize]) + self.baseSmoke
-        #If there actually are particles(a smoke machine has been created and turned on)
-        if self.smokeParticlePositions.size > 0:
-            toDelete = [] #List of illegal particles to be removed
-            for i in range(0, len(self.smokeParticlePositions)):
-                smokeParticlePosition = self.smokeParticlePositions[i]
-                if min(smokeParticlePosition) < 0 or smokeParticlePosition[0] > self.horizontalSize or smokeParticlePosition[1] > self.verticalSize or self.smokeParticleIntensities[i] <= 0:
-                    #If particle is illegal add it to the list to be deleted
-                    toDelete.append(i)
-                else:
-                    #Set the raw smoke cells
-                    endPosition = smokeParticlePosition + self.particleSize
-                    newSmokeScreen[int(smokeParticlePosition[0]):int(endPosition[0]), int(smokeParticlePosition[1]):int(endPosition[1])] += self.smokeParticleIntensities[i]
+            minX = max(0, int((smokeMachine.position[0] - positionSpread / 2) / self.smokeScale))
+            maxX = max(0, int((smokeMachine.position[0] + positionSpread / 2) / self.smokeScale))
+            minY = max(0, int((smokeMachine.position[1] - positionSpread / 2) / self.smokeScale))
+            maxY = max(0, int((smokeMachine.position[1] + positionSpread / 2) / self.smokeScale))
 
-            #Delete illegal particles
-            self.smokeParticlePositions = np.delete(self.smokeParticlePositions, toDelete, 0)
-            self.smokeParticleVelocities = np.delete(self.smokeParticleVelocities, toDelete, 0)
-            self.smokeParticleIntensities = np.delete(self.smokeParticleIntensities, toDelete, 0)
+            self.density[minX:maxX, minY:maxY] += smokeMachine.strength * injectionRate * dt
 
-        #Diffuse the smoke with moore neighbourhoods
-        blurSize = 40
-        newSmokeScreen = cv2.blur(newSmokeScreen[self.particleSize:-self.particleSize, self.particleSize:-self.particleSize], [blurSize, blurSize])
-        self.smokeScreen =  np.clip(newSmokeScreen, 0, 1)
+            #Particles leave the machine at speed plus half the random extra speed on average, spread across the angle range
+            speed = (smokeMachine.speed + 50.0) * math.sin(np.deg2rad(angleSpread)) / np.deg2rad(angleSpread)
+            direction = np.deg2rad(smokeMachine.direction)
+            self.jetVelocity[minX:maxX, minY:maxY] = [speed * math.cos(direction), speed * math.sin(direction)]
+
+        return injected
+
+    #Move a field along the velocity by looking back to where each cell's contents came from(semi-Lagrangian advection)
+    def advectField(self, field, velocity, dt):
+        dt /= self.smokeScale   #Velocity is in pixels, so it moves fewer cells when the grid is smaller
+        sourceRows = self.cellRows - velocity[:, :, 0] * dt
+        sourceColumns = self.cellColumns - velocity[:, :, 1] * dt
+        return cv2.remap(field, sourceColumns, sourceRows, cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+    #Move, diffuse and fade the smoke density and get a new smoke level output
+    def updateSmokeScreen(self, dt):
+        self.updateFlow(dt)
+        for smokeMachine in self.smokeMachines:
+            smokeMachine.update(dt)
+
+        #Constants chosen so the grid behaves like particles at 30 frames per second
+        velocityRetention = 0.94 ** 30  #How much jet velocity is retained after a second
+        diffusionRate = 50.0            #How quickly smoke spreads out, in pixels squared per second
+        smokeLife = 5.0                 #Time taken for smoke to fade to 1/e of its density
+
+        profiler = self.profiler
+        if profiler != None:
+            startTime = profiler.startStage()
+
+        injected = self.injectSmoke(dt)
+        if profiler != None:
+            startTime = profiler.endStage("spawn", startTime)
+
+        #Once there is no smoke left moving it or blurring it leaves it empty, so only the jets are moved on, and nothing once they have stopped
+        empty = self.settled and not injected
+        if dt > 0 and not (empty and not self.jetVelocity.any()):
+            velocity = self.jetVelocity + self.driftVelocity
+            if not empty:
+                self.density = self.advectField(self.density, velocity, dt)
+
+                #Smoke bunches up where the flow slows down and thins out where it speeds up
+                divergence = np.gradient(velocity[:, :, 0], axis=0) + np.gradient(velocity[:, :, 1], axis=1)
+                self.density *= np.exp(np.clip(-divergence * dt / self.smokeScale, -1, 1))
+            self.jetVelocity = self.advectField(self.jetVelocity, velocity, dt) * velocityRetention ** dt
+
+            #Spread the jets out as well, a sharp edged jet would leave smoke behind at its edges
+            diffusionSize = math.sqrt(2 * diffusionRate * dt) / self.smokeScale
+            if not empty:
+                self.density = cv2.GaussianBlur(self.density, [0, 0], diffusionSize)
+            self.jetVelocity = cv2.GaussianBlur(self.jetVelocity, [0, 0], 4 * diffusionSize)
+            if not empty:
+                self.density *= math.exp(-dt / smokeLife)
+        if profiler != None:
+            startTime = profiler.endStage("advect", startTime)
+
+        #Diffuse the smoke with moore neighbourhoods to match the look of the particle engine
+        if not empty:
+            blurSize = max(1, round(40 / self.smokeScale))
+            newSmokeScreen = cv2.blur(self.density, [blurSize, blurSize]) + self.baseSmoke
+            self.smokeScreen = np.clip(newSmokeScreen, 0, 1).astype(np.float64)
+            self.settled = not self.density.any()
+            self.version += 1
+        if profiler != None:
+            profiler.endStage("deposit", startTime)
 
 class Background:
     def __init__(self, horizontalSize, verticalSize):
         self.horizontalSize = horizontalSize
         self.verticalSize = verticalSize
         self.image = np.zeros([horizontalSize, verticalSize, 3])
+        self.version = 0    #Goes up every time the image changes so anything drawn from it knows to redraw
     
     def getBackground(self):
         return self.image
@@ -389,129 +1181,409 @@ class Background:
         image = None
         
         try:
-            image = plt.imread(imageLocation)   #Read the image
+            image = readImage(imageLocation)   #Read the image
             image = image[:,:,:3]               #Remove the alpha value
             image = cv2.resize(image, [self.horizontalSize, self.verticalSize])
             image = image.swapaxes(0, 1)
-            self.image = image
+            if image.shape != self.image.shape or not np.array_equal(image, self.image):
+                self.image = image
+                self.version += 1
         except FileNotFoundError:
             print("File not Found")
         except:
             print("File Invalid")
 
 
+#An image ready to be drawn on the stage, stored with its colors already multiplied by alpha
+#Sprites are shared between objects so none of the arrays can be edited
+#centre is the point objects turn and scale about, objects keep it in the same place on screen whichever sprite they use
+class Sprite:
+    def __init__(self, image, centre = None):
+        self.image = image
+        self.horizontalSize = image.shape[0]
+        self.verticalSize = image.shape[1]
+        if centre is None:
+            centre = [self.horizontalSize / 2, self.verticalSize / 2]
+        self.centre = centre
+
+        #Colors are multiplied by alpha once here so blending only needs a multiply and an add
+        alpha = np.ascontiguousarray(image[:, :, 3:], np.float32)
+        self.premultipliedImage = np.ascontiguousarray(image[:, :, :3] * alpha, np.float32)
+        self.transparency = 1 - alpha
+
+        for array in [self.image, self.premultipliedImage, self.transparency]:
+            array.setflags(write=False)
+        self.nbytes = self.image.nbytes + self.premultipliedImage.nbytes + self.transparency.nbytes
+
+#Store of every image loaded by objects, shared by the whole program so each file is only read once
+#Every image is also turned and scaled to each of the variant angles and scales when it is first loaded, so objects can change between them every frame
+#The loader sets the variants to the angles and scales the objects in the show reach
+class SpriteCache:
+    def __init__(self, maxBytes = 256 * 2 ** 20, variantAngles = [0.0], variantScales = [1.0]):
+        self.maxBytes = maxBytes            #Memory the cache may use before the least recently used images are removed
+        self.variantAngles = variantAngles  #Angles in degrees, anticlockwise, prepared for every image
+        self.variantScales = variantScales  #Scales prepared for every image
+
+        #An image turned or scaled further than this from what was asked for is warned about once
+        self.maxAngleError = 15.0
+        self.maxScaleError = 0.25
+        self.snapWarnings = set()           #Images that have been warned about
+
+        self.entries = OrderedDict()        #Decoded files and sprites, least recently used first
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def getEntry(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return entry
+
+    def putEntry(self, key, entry):
+        if key in self.entries:
+            self.bytes -= self.entries[key].nbytes
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self.bytes += entry.nbytes
+        self.evict()
+
+    #Remove the least recently used entries until the cache fits in maxBytes, objects still using them keep their own reference
+    def evict(self):
+        while self.bytes > self.maxBytes and len(self.entries) > 1:
+            key, entry = self.entries.popitem(last=False)
+            self.bytes -= entry.nbytes
+            self.evictions += 1
+
+    #Read an image file, only reading each file once
+    def getDecodedImage(self, imageLocation):
+        key = ("file", imageLocation)
+        image = self.getEntry(key)
+        if image is None:
+            image = readImage(imageLocation)
+            image.setflags(write=False)
+            self.putEntry(key, image)
+        return image
+
+    #Change the angles and scales prepared for every image, variants already made for other images are kept until they are evicted
+    def setVariants(self, variantAngles, variantScales):
+        self.variantAngles = variantAngles
+        self.variantScales = variantScales
+
+    #Returns the variant closest to angle and scale of an image turned by rotation quarter turns and resized to horizontalSize
+    def getSprite(self, imageLocation, horizontalSize, rotation, angle = 0.0, scale = 1.0):
+        variantAngle = min(self.variantAngles, key=lambda variantAngle: abs((variantAngle - angle + 180) % 360 - 180))
+        variantScale = min(self.variantScales, key=lambda variantScale: abs(variantScale - scale))
+
+        if (abs((variantAngle - angle + 180) % 360 - 180) > self.maxAngleError or abs(variantScale - scale) > self.maxScaleError) and imageLocation not in self.snapWarnings:
+            print("Warning: " + str(imageLocation) + " is drawn at " + str(variantAngle) + " degrees and scale " + str(variantScale) + " instead of " + str(angle) + " degrees and scale " + str(scale) + ", add them to the sprite cache variants")
+            self.snapWarnings.add(imageLocation)
+        angle = variantAngle
+        scale = variantScale
+
+        key = ("sprite", imageLocation, int(horizontalSize), int(rotation), angle, scale)
+        sprite = self.getEntry(key)
+        if sprite is None:
+            sprite = self.addVariants(imageLocation, int(horizontalSize), int(rotation))[key]
+        return sprite
+
+    #Make every variant of an image at once, returning them all in case the cache is too small to hold them
+    #Variants that are still in the cache are kept, so objects already using them keep sharing them
+    def addVariants(self, imageLocation, horizontalSize, rotation):
+        #Load and rotate image
+        image = self.getDecodedImage(imageLocation)
+        image = np.rot90(image, rotation + 2, (0, 1))
+        
+        #If needed add alpha channel
+        if image.shape[2] == 3:
+            image = np.append(image, np.ones([image.shape[0], image.shape[1], 1], image.dtype), 2)
+        
+        #Rescale image
+        verticalSize = int(horizontalSize / image.shape[1] * image.shape[0])
+        image = cv2.resize(np.ascontiguousarray(image), [horizontalSize, verticalSize])
+
+        #Objects turn and scale about the middle of the pixels that can be seen, not the middle of the image
+        alpha = image[:, :, 3]
+        centre = np.array([image.shape[1] / 2, image.shape[0] / 2, 1])
+        if alpha.sum() > 0:
+            rows, columns = np.indices(alpha.shape)
+            centre[:2] = [(columns * alpha).sum() / alpha.sum(), (rows * alpha).sum() / alpha.sum()]
+
+        sprites = {}
+        for angle in self.variantAngles:
+            for scale in self.variantScales:
+                key = ("sprite", imageLocation, horizontalSize, rotation, angle, scale)
+                if key in self.entries:
+                    sprites[key] = self.entries[key]
+                    self.entries.move_to_end(key)
+                else:
+                    transformedImage, matrix = self.transformImage(image, angle, scale)
+                    sprites[key] = Sprite(transformedImage.swapaxes(0, 1), matrix @ centre)
+                    self.putEntry(key, sprites[key])
+        return sprites
+
+    #Turn and scale an image about its centre, growing it so none of the image is cut off
+    #Returns the new image and the matrix that moves a point on the old image to the same point on the new image
+    def transformImage(self, image, angle, scale):
+        if angle == 0 and scale == 1:
+            return image, np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+
+        rows, columns = image.shape[:2]
+        matrix = cv2.getRotationMatrix2D([columns / 2, rows / 2], angle, scale)
+        newColumns = int(math.ceil(abs(matrix[0, 0]) * columns + abs(matrix[0, 1]) * rows))
+        newRows = int(math.ceil(abs(matrix[1, 0]) * columns + abs(matrix[1, 1]) * rows))
+        matrix[0, 2] += (newColumns - columns) / 2
+        matrix[1, 2] += (newRows - rows) / 2
+        return cv2.warpAffine(image, matrix, [max(newColumns, 1), max(newRows, 1)], flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0), matrix
+
+    def getStats(self):
+        return {
+            "hits" : self.hits,
+            "misses" : self.misses,
+            "evictions" : self.evictions,
+            "entries" : len(self.entries),
+            "bytes" : self.bytes
+        }
+
 #Objects are images that can move
 class Object:
+    spriteCache = SpriteCache()     #Images shared by every object
+
     def __init__(self, imageLocation, rotation, position, horizontalSize, instructionSet, screenHorizontalSize, screenVerticalSize):
+        self.version = 0        #Goes up every time the object moves or its image changes
+        self.horizontalPosition = self.verticalPosition = self.sprite = None
         self.setPosition(position)
-        self.horizontalSize = horizontalSize    #Horizontal size of rescaled image
+        self.imageLocation = imageLocation
+        self.rotation = rotation
+        self.baseHorizontalSize = horizontalSize    #Horizontal size of rescaled image before it is scaled
         self.screenHorizontalSize = screenHorizontalSize
         self.screenVerticalSize = screenVerticalSize
+        self.angle = 0.0
+        self.scale = 1.0
         
         #Choreograpy setup
-        self.instructionSet = instructionSet
+        self.timeline = Timeline(instructionSet, ["Horizontal Position", "Vertical Position", "Angle", "Scale"], [position[0], position[1], self.angle, self.scale])
         self.halted = False
         self.time = 0
-        self.instructionIndex = 0
         
         try:
-            #Load and rotate image
-            image = plt.imread(imageLocation)
-            image = np.rot90(image, rotation + 2, (0, 1))
-            
-            #If needed add alpha channel
-            if image.shape[2] == 3:
-                image = np.append(image, 1.0, 3)
-            
-            #Rescale image
-            self.verticalSize = int(horizontalSize / image.shape[1] * image.shape[0])
-            image = cv2.resize(image, [horizontalSize, self.verticalSize])
-            self.image = image.swapaxes(0, 1)
+            sprite = Object.spriteCache.getSprite(imageLocation, horizontalSize, rotation)
         except:
             print("File Invalid")
-            self.image = np.zeros([horizontalSize, horizontalSize, 4])
-            self.verticalSize = horizontalSize
+            self.imageLocation = None
+            sprite = Sprite(np.zeros([horizontalSize, horizontalSize, 4], np.float32))
+        self.baseCentre = sprite.centre     #Centre of the sprite before it is turned or scaled
+        self.setSprite(sprite)
+
+    def setSprite(self, sprite):
+        if sprite is not self.sprite:
+            self.version += 1
+        self.sprite = sprite
+        self.image = sprite.image
+        self.premultipliedImage = sprite.premultipliedImage
+        self.transparency = sprite.transparency
+        self.horizontalSize = sprite.horizontalSize
+        self.verticalSize = sprite.verticalSize
+
+        #Turned and scaled sprites are a different size, so they are drawn moved to keep the centre of the object in the same place
+        self.horizontalOffset = int(round(self.baseCentre[0] - sprite.centre[0]))
+        self.verticalOffset = int(round(self.baseCentre[1] - sprite.centre[1]))
+
+    #Angles and scales the choreography turns and scales the object to
+    #Keyframes are included exactly, and every angleStep degrees and scaleStep between them so moves between keyframes are smooth
+    def getTransforms(self, angleStep, scaleStep):
+        keyframeLists = [self.timeline.values]
+        if self.timeline.loopStart != None:
+            keyframeLists.append(self.timeline.loopValues)
+
+        angles = set()
+        scales = set()
+        for keyframes in keyframeLists:
+            for start, end in zip(keyframes[:-1], keyframes[1:]):
+                minAngle, maxAngle = sorted([start[2], end[2]])
+                minScale, maxScale = sorted([start[3], end[3]])
+                angles.update([minAngle, maxAngle])
+                angles.update(np.arange(math.ceil(minAngle / angleStep), math.floor(maxAngle / angleStep) + 1) * angleStep)
+                scales.update([minScale, maxScale])
+                scales.update(np.arange(math.ceil(minScale / scaleStep), math.floor(maxScale / scaleStep) + 1) * scaleStep)
+
+        return {float(angle % 360) for angle in angles}, {float(scale) for scale in scales if scale > 0}
+
+    #Turn the object by angle degrees and scale it, using the closest variant in the sprite cache
+    def setTransform(self, angle, scale):
+        if (angle != self.angle or scale != self.scale) and self.imageLocation != None:
+            self.angle = angle
+            self.scale = scale
+            self.setSprite(Object.spriteCache.getSprite(self.imageLocation, self.baseHorizontalSize, self.rotation, angle, scale))
     
-    #Place the object on the screen in its current position and return the screen
-    def getObjectScreen(self):
-        screen = np.zeros([self.screenHorizontalSize, self.screenVerticalSize, 4])
-        
-        minX = max(0, -self.horizontalPosition)
-        maxX = min(self.horizontalSize, self.screenHorizontalSize - self.horizontalPosition)
+    #Returns the part of the screen the object covers and the matching part of the image, or None if it is off screen
+    def getScreenRectangle(self):
+        horizontalPosition = self.horizontalPosition + self.horizontalOffset
+        verticalPosition = self.verticalPosition + self.verticalOffset
+
+        minX = max(0, -horizontalPosition)
+        maxX = min(self.horizontalSize, self.screenHorizontalSize - horizontalPosition)
         maxX = max(0, maxX)
         dX = maxX - minX
         
         
-        minY = max(0, -self.verticalPosition)
-        maxY = min(self.verticalSize, self.screenVerticalSize - self.verticalPosition)
+        minY = max(0, -verticalPosition)
+        maxY = min(self.verticalSize, self.screenVerticalSize - verticalPosition)
         maxY = max(0, maxY)
         dY = maxY - minY
         
-        xPos = max(0, self.horizontalPosition)
+        xPos = max(0, horizontalPosition)
         xPos = min(xPos, self.screenHorizontalSize)
 
-        yPos = max(0, self.verticalPosition)
+        yPos = max(0, verticalPosition)
         yPos = min(yPos, self.screenVerticalSize)
 
-        screen[xPos:(xPos + dX), yPos:(yPos + dY)] = self.image[minX:maxX, minY:maxY]
-        return screen
+        if dX <= 0 or dY <= 0:
+            return None
+        return (slice(xPos, xPos + dX), slice(yPos, yPos + dY)), (slice(minX, maxX), slice(minY, maxY))
+
+    #Blend the object over screen in place, only touching the pixels the object covers
+    def blitToScreen(self, screen):
+        rectangle = self.getScreenRectangle()
+        if rectangle != None:
+            screenRectangle, imageRectangle = rectangle
+            screenPixels = screen[screenRectangle]
+            screenPixels *= self.transparency[imageRectangle]
+            screenPixels += self.premultipliedImage[imageRectangle]
     
     def setPosition(self, position):
-        self.horizontalPosition = int(position[0])
-        self.verticalPosition = int(position[1])
+        horizontalPosition = int(position[0])
+        verticalPosition = int(position[1])
+        if horizontalPosition != self.horizontalPosition or verticalPosition != self.verticalPosition:
+            self.horizontalPosition = horizontalPosition
+            self.verticalPosition = verticalPosition
+            self.version += 1
+
+    #Everything that decides what the object looks like on screen, if this is the same as last frame the object has not moved
+    def getLayerKey(self):
+        return (self.horizontalPosition, self.verticalPosition, id(self.sprite))
     
+    #Returns everything needed to put the object back in its current state
+    def getSnapshot(self):
+        return {
+            "time" : self.time,
+            "halted" : self.halted,
+            "position" : [self.horizontalPosition, self.verticalPosition],
+            "angle" : self.angle,
+            "scale" : self.scale
+        }
+
+    def setSnapshot(self, snapshot):
+        self.time = snapshot["time"]
+        self.halted = snapshot["halted"]
+        self.setPosition(snapshot["position"])
+        self.setTransform(snapshot["angle"], snapshot["scale"])
 
     #Update the object to follow the relevant instruction given by choreography
     def update(self, dt):
         #Instruction Set:Move to, Loop To(Row Index), Hold, Stop, End(Kills whole program)
         if self.halted == False:
             self.time += dt
+            if self.time > self.timeline.endTime:
+                raise(end)
 
-            instruction = self.instructionSet.iloc[self.instructionIndex]
-            if self.time > instruction.get("End Time"):
-                self.instructionIndex += 1
-            
-            currentInstruction = instruction.get("Instruction")
-            if currentInstruction == None:
-                self.halted = True
-
-            elif currentInstruction == "Move To":
-                remainingTime = instruction.get("End Time") - self.time
-                if remainingTime == 0:
-                    moveFraction = 1
-                else:
-                    moveFraction = min(dt / remainingTime, 1)
-                horizontalPosition = lerp(self.horizontalPosition, instruction.get("Horizontal Position"), moveFraction)
-                verticalPosition = lerp(self.verticalPosition, instruction.get("Vertical Position"), moveFraction)
-                self.setPosition([horizontalPosition, verticalPosition])
-            
-            elif currentInstruction == "Loop To":
-                self.instructionIndex = int(instruction.get("Loop To Index"))
-                if self.instructionIndex == 0:
-                    self.time = 0
-                else:
-                    self.time = instruction.get("End Time").get(self.instructionIndex - 1)
-            
-            elif currentInstruction == "Hold":
-                pass
-            
-            elif currentInstruction == "Stop":
-                self.halted = True
-            
-            elif currentInstruction == "End":
-                raise(end) 
+            values, step = self.timeline.getState(self.time)
+            self.setPosition(values[:2])
+            self.setTransform(values[2], values[3])
+
+            self.halted = self.timeline.isFinished(self.time)
+
+#Layers of the frame the scene keeps and reuses while nothing they are drawn from changes
+reuseLayerNames = ["lights", "objects", "smoke", "frame"]
 
 #Controls all the things on the stage
 class Scene:
-    def __init__(self, horizontalSize, verticalSize, baseSmoke):
+    def __init__(self, horizontalSize, verticalSize, baseSmoke, smokeEngine = "particle", batchLights = False, compositeMode = "float64", smokeScale = 1, tileSize = 32, tileWorkers = 1, particleCapacity = 200000, overflowPolicy = "drop oldest"):
         self.horizontalSize = horizontalSize
         self.verticalSize = verticalSize
 
         self.lightList = []
         self.objectList = []
 
+        #Large rigs are faster to draw all at once than one light at a time
+        self.batchLights = batchLights
+        self.lightRasterizer = LightRasterizer(horizontalSize, verticalSize)
+
         self.background = Background(horizontalSize, verticalSize)
-        self.smoke = SmokeScreen(horizontalSize, verticalSize, baseSmoke)
+
+        #Smoke can either be simulated as particles or as a density grid
+        smokeEngines = {
+            "particle" : SmokeScreen,
+            "grid" : GridSmokeScreen
+        }
+
+        if smokeEngine not in smokeEngines:
+            print("Error: Smoke engine " + str(smokeEngine) + " is invalid")
+            smokeEngine = "particle"
+
+        #Smoke can be simulated at 1/2, 1/4 or 1/8 of the screen size, it is stretched back to the screen size when the frame is drawn
+        if smokeScale not in [1, 2, 4, 8]:
+            print("Error: Smoke scale " + str(smokeScale) + " is invalid")
+            smokeScale = 1
+        smokeOptions = {"smokeScale" : smokeScale}
+
+        #The particle engine keeps at most particleCapacity particles, overflowPolicy decides if new ones replace the oldest or are refused once it is full
+        if overflowPolicy not in ["drop oldest", "refuse"]:
+            print("Error: Overflow policy " + str(overflowPolicy) + " is invalid")
+            overflowPolicy = "drop oldest"
+        if smokeEngine == "particle":
+            smokeOptions["particleCapacity"] = particleCapacity
+            smokeOptions["overflowPolicy"] = overflowPolicy
+        self.smoke = smokeEngines[smokeEngine](horizontalSize, verticalSize, baseSmoke, **smokeOptions)
+
+        #The float32 mode draws every frame into buffers kept by the scene instead of making new arrays for every step
+        #The tiled mode uses the same buffers but only combines the screens in tiles a light reaches
+        if compositeMode not in ["float64", "float32", "tiled"]:
+            print("Error: Composite mode " + str(compositeMode) + " is invalid")
+            compositeMode = "float64"
+        self.compositeMode = compositeMode
+        self.tiledCompositor = None
+        if compositeMode == "tiled":
+            self.tiledCompositor = TiledCompositor(horizontalSize, verticalSize, tileSize, tileWorkers)
+        if compositeMode != "float64":
+            self.lightBuffer = np.zeros([horizontalSize, verticalSize, 3], np.float32)
+            self.backdropBuffer = np.zeros([horizontalSize, verticalSize, 3], np.float32)
+            self.outputBuffer = np.zeros([horizontalSize, verticalSize, 3], np.float32)
+            self.smokeBuffer = np.zeros([horizontalSize, verticalSize])
+            layerType = np.float32
+        else:
+            self.backdropBuffer = np.zeros([horizontalSize, verticalSize, 3])
+            layerType = np.float64
+
+        #The backdrop and objects that are not moving are drawn once into the static layer and reused until one of them changes
+        self.staticLayer = np.zeros([horizontalSize, verticalSize, 3], layerType)
+        self.staticLayerKeys = None         #Layer keys of the objects drawn into the static layer, None when it needs redrawing
+        self.staticLayerVersion = -1        #Background version the static layer was drawn from
+        self.lastObjectKeys = []
+        self.stillFrames = []               #Number of frames each object has not moved for
+        self.staticFrameCount = 10          #Frames an object must stay still before it joins the static layer, so slow moving objects don't keep redrawing it
+        self.staticLayerRebuilds = 0
+
+        #Each layer of the frame is kept with the versions of everything it was drawn from, and reused while none of them change
+        #Turning reuseLayers off draws every layer every frame, eg to time drawing a frame that hasn't changed
+        self.reuseLayers = True
+        self.lightScreen = None
+        self.lightVersions = None
+        self.backdrop = None
+        self.backdropVersions = None
+        self.smokeScreen = None
+        self.smokeVersion = None
+        self.frame = None
+        self.frameVersions = None
+        self.reuseCounts = {layerName : 0 for layerName in reuseLayerNames}
+        self.drawCounts = {layerName : 0 for layerName in reuseLayerNames}
+
+        self.profiler = None                #Times each part of the frame when set with setProfiler
+        self.pipeline = None                #Draws frames on several threads when set with setPipeline
     
     def addLight(self, xPosition, direction, strength, spreadAngle, width, color, instructionSet):
         self.lightList.append(Light(xPosition, self.verticalSize, direction, strength, spreadAngle, width, color, instructionSet, self.horizontalSize, self.verticalSize))
@@ -522,47 +1594,122 @@ class Scene:
     def addObject(self, imageLocation, rotation, position, horizontalSize, instructionSet):
         self.objectList.append(Object(imageLocation, rotation, position, horizontalSize, instructionSet, self.horizontalSize, self.verticalSize))
 
-    #Deals with the top figure that shows the light position, strength, angle and color
-    def getLightPatchCollection(self):
-        patches = []
-        colors = np.array([[]])
-
-        for light in self.lightList:
-            newcolor = np.array([light.getColor(), light.getColor()])
-            
-            #Store the color of the light
-            if colors.size == 0:
-                colors = newcolor
-            else:
-                colors = np.append(colors, newcolor, axis=0)
-            
-            colors = np.clip(colors, 0, 1)
-            #Set the shape and position of the light
-            position = (light.getHorizontalPosition(), 26)
-            minAngle = light.getMinAngle()
-            maxAngle = light.getMaxAngle()
-            patches.append(Wedge(position, 20, minAngle, maxAngle))
-            
-            #For lasers create a parralelogram
-            p0 = position
-            p1 = position + np.array([light.getWidth(), 0])
-            down = 20 * np.array([math.cos(np.deg2rad(minAngle)), math.sin(np.deg2rad(minAngle))])
-            p2 = p1 + down
-            p3 = p0 + down
-            patches.append(Polygon(np.array([p0, p1, p2, p3]), closed=True))
-        
-        #Set the colors of the shapes
-        colors *= 0.99
-        collection = PatchCollection(patches, alpha=1.0)
-        collection.set_facecolors(colors)
-
-        return collection
-
-
+    #Have the sprite cache prepare every angle and scale the objects are turned and scaled to, as well as the ones it already has
+    def prepareObjectTransforms(self, angleStep = 15.0, scaleStep = 0.25):
+        angles = set(Object.spriteCache.variantAngles)
+        scales = set(Object.spriteCache.variantScales)
+        for stageObject in self.objectList:
+            objectAngles, objectScales = stageObject.getTransforms(angleStep, scaleStep)
+            angles.update(objectAngles)
+            scales.update(objectScales)
+        Object.spriteCache.setVariants(sorted(angles), sorted(scales))
+
+    #Shapes for the top figure that shows the light position, strength, angle and color, as arrays with one row per light
+    #Each light is a wedge showing its spread and a parralelogram showing its width
+    def getLightOverview(self):
+        lightCount = len(self.lightList)
+        centers = np.zeros([lightCount, 2])
+        minAngles = np.zeros(lightCount)
+        maxAngles = np.zeros(lightCount)
+        widths = np.zeros(lightCount)
+        colors = np.zeros([lightCount, 3])
+
+        for i, light in enumerate(self.lightList):
+            centers[i] = [light.getHorizontalPosition(), 26]
+            minAngles[i] = light.getMinAngle()
+            maxAngles[i] = light.getMaxAngle()
+            widths[i] = light.getWidth()
+            colors[i] = light.getColor()
+
+        #For lasers create a parralelogram
+        down = 20 * np.stack([np.cos(np.deg2rad(minAngles)), np.sin(np.deg2rad(minAngles))], -1)
+        right = np.stack([widths, np.zeros(lightCount)], -1)
+        laserCorners = np.stack([centers, centers + right, centers + right + down, centers + down], 1)
+
+        return {
+            "centers" : centers,
+            "minAngles" : minAngles,
+            "maxAngles" : maxAngles,
+            "laserCorners" : laserCorners,
+            "colors" : np.clip(colors, 0, 1) * 0.99
+        }
 
     def setBackground(self, imageLocation):
         self.background.setBackground(imageLocation)
 
+    #Have the smoke follow a FlowVolume that changes over time
+    def setFlowVolume(self, flowVolume):
+        self.smoke.setFlowVolume(flowVolume)
+
+    #Time every part of each frame drawn by render with a frameProfiler.FrameProfiler, or stop profiling with None
+    #Parts of the smoke step are not timed while a pipeline is set, as they run on another thread
+    def setProfiler(self, profiler):
+        self.profiler = profiler
+        if self.pipeline == None:
+            self.smoke.profiler = profiler
+
+    #Draw frames with a renderPipeline.RenderPipeline, or go back to drawing them on one thread with None
+    #The pipeline may simulate the next frame's smoke as soon as a frame is drawn, so snapshots should be taken without one
+    def setPipeline(self, pipeline):
+        if self.pipeline != None and self.pipeline is not pipeline:
+            self.pipeline.close()
+        self.pipeline = pipeline
+        self.smoke.profiler = self.profiler if pipeline == None else None
+
+    #Returns the backdrop with every object overlayed
+    #Objects are drawn in order, so only the objects before the first moving one can be kept in the static layer
+    def getBackdrop(self):
+        versions = (self.background.version, [object.version for object in self.objectList])
+        if self.reuseLayers and versions == self.backdropVersions:
+            self.stillFrames = [stillFrames + 1 for stillFrames in self.stillFrames]
+            self.reuseCounts["objects"] += 1
+            return self.backdrop
+
+        self.backdrop = self.drawBackdrop()
+        self.backdropVersions = versions
+        self.drawCounts["objects"] += 1
+        return self.backdrop
+
+    def drawBackdrop(self):
+        objectKeys = [object.getLayerKey() for object in self.objectList]
+        stillFrames = []
+        for i in range(len(objectKeys)):
+            if i < len(self.lastObjectKeys) and objectKeys[i] == self.lastObjectKeys[i]:
+                stillFrames.append(self.stillFrames[i] + 1)
+            else:
+                stillFrames.append(0)
+        self.lastObjectKeys = objectKeys
+        self.stillFrames = stillFrames
+
+        #Objects already in the layer stay as long as they have not moved
+        cachedKeys = self.staticLayerKeys
+        staticCount = 0
+        while staticCount < len(objectKeys) and stillFrames[staticCount] > 0 and (stillFrames[staticCount] >= self.staticFrameCount or (cachedKeys != None and staticCount < len(cachedKeys))):
+            staticCount += 1
+
+        #Redraw the static layer if the background changed or an object in it has moved
+        layer = self.staticLayer
+        if cachedKeys == None or self.staticLayerVersion != self.background.version or len(cachedKeys) > staticCount or cachedKeys != objectKeys[:len(cachedKeys)]:
+            np.copyto(layer, np.fliplr(self.background.getBackground()))
+            self.staticLayerVersion = self.background.version
+            self.staticLayerRebuilds += 1
+            cachedKeys = []
+
+        #Objects that have just stopped moving are added onto the layer
+        for object in self.objectList[len(cachedKeys):staticCount]:
+            object.blitToScreen(layer)
+        self.staticLayerKeys = objectKeys[:staticCount]
+
+        if staticCount == len(self.objectList):
+            return layer
+
+        #Moving objects are drawn over a copy so the static layer is kept
+        backdrop = self.backdropBuffer
+        np.copyto(backdrop, layer)
+        for object in self.objectList[staticCount:]:
+            object.blitToScreen(backdrop)
+        return backdrop
+
     #Calculate the frame to be displayed
     #Everything is done in screens, each screen is a 3d numpy array, 2 for pixel location(size of output image) and one for color
     #Light screens are everywhere light is emitted
@@ -570,33 +1717,146 @@ class Scene:
     #Object screen is colors of objects
     #Backdrop Screen is the backdrop color    
     def render(self, dt):
+        if self.pipeline != None:
+            return self.pipeline.render(dt)
+
+        if self.profiler != None:
+            self.profiler.beginFrame()
+
+        self.update(dt)
+        frame = self.composite()
+
+        if self.profiler != None:
+            self.profiler.endFrame(self)
+        return frame
+
+    #Move everything on the stage forward by dt seconds without drawing anything
+    def update(self, dt):
+        if self.pipeline != None:
+            self.pipeline.update(dt)
+            return
+
+        profiler = self.profiler
+        if profiler != None:
+            startTime = profiler.startStage()
+
         self.smoke.updateSmokeScreen(dt)
-        
-        #Each light screen is gotten and added elementwise producing an overall lightscreen
-        lightScreen = np.zeros([self.horizontalSize, self.verticalSize, 3])
+        if profiler != None:
+            startTime = profiler.endStage("smoke", startTime)
+
+        self.updateMovement(dt)
+        if profiler != None:
+            profiler.endStage("movement", startTime)
+
+    #Move the lights and objects forward by dt seconds
+    def updateMovement(self, dt):
         for light in self.lightList:
             light.update(dt)
-            lightScreen += light.getLightScreen()
+
+        for object in self.objectList:
+            object.update(dt)
+
+    #Each light screen is gotten and added elementwise producing an overall lightscreen
+    #If no light has changed since the last light screen was drawn it is returned instead, without drawing into lightScreen
+    def getLightScreen(self, lightScreen = None):
+        versions = [light.version for light in self.lightList]
+        if self.reuseLayers and versions == self.lightVersions:
+            self.reuseCounts["lights"] += 1
+            return self.lightScreen
+
+        self.lightScreen = self.drawLightScreen(lightScreen)
+        self.lightVersions = versions
+        self.drawCounts["lights"] += 1
+        return self.lightScreen
+
+    def drawLightScreen(self, lightScreen):
+        if lightScreen is None:
+            lightScreen = self.getLightBuffer()
+        if self.batchLights:
+            return self.lightRasterizer.getLightScreen(self.lightList, lightScreen)
+
+        lightScreen.fill(0)
+        for light in self.lightList:
+            light.addLightToScreen(lightScreen)
+        return lightScreen
+
+    #The brightest any pixel can be, as smoke and backdrop never reflect more light than reaches them
+    def getMaxBrightness(self):
+        if len(self.lightList) == 0:
+            return 0.0
+        return float(np.sum([light.getColor() for light in self.lightList], 0).max())
+
+    #Draw the frame for the current state of the stage
+    def composite(self):
+        profiler = self.profiler
+        if profiler != None:
+            startTime = profiler.startStage()
+
+        lightScreen = self.getLightScreen()
+        if profiler != None:
+            startTime = profiler.endStage("lights", startTime)
+
+        #Backdrop is gotten with objects overlayed
+        backdrop = self.getBackdrop()
+        if profiler != None:
+            startTime = profiler.endStage("objects", startTime)
+
+        output = self.combineScreens(lightScreen, backdrop)
+        if profiler != None:
+            profiler.endStage("composite", startTime)
+        return output
+
+    #Screen for the lights to be drawn into, the float32 mode reuses the same one every frame
+    def getLightBuffer(self):
+        if self.compositeMode != "float64":
+            return self.lightBuffer
+        return np.zeros([self.horizontalSize, self.verticalSize, 3])
+
+    #Smoke level at every pixel of the screen
+    #Smoke simulated on a smaller grid is stretched to the screen size here, the only time it is done each frame
+    #The stretched smoke is kept until the smoke changes
+    def getSmokeScreen(self, smokeBuffer = None):
+        smokeScreen = self.smoke.getSmokeScreen()
+        if self.smoke.smokeScale == 1:
+            return smokeScreen
+
+        if self.reuseLayers and self.smoke.version == self.smokeVersion:
+            self.reuseCounts["smoke"] += 1
+            return self.smokeScreen
+
+        self.smokeScreen = cv2.resize(smokeScreen, [self.verticalSize, self.horizontalSize], dst=smokeBuffer, interpolation=cv2.INTER_LINEAR)
+        self.smokeVersion = self.smoke.version
+        self.drawCounts["smoke"] += 1
+        return self.smokeScreen
+
+    #Light the smoke and backdrop to produce the final frame
+    #The smoke screen from getSmokeScreen can be given if it was found on another thread
+    #The light screen and backdrop should be the ones from getLightScreen and getBackdrop, if neither they nor the smoke have changed the last frame is returned again
+    def combineScreens(self, lightScreen, backdrop, smokeScreen = None):
+        versions = (self.lightVersions, self.backdropVersions, self.smoke.version)
+        if self.reuseLayers and versions == self.frameVersions:
+            self.reuseCounts["frame"] += 1
+            return self.frame
+
+        self.frame = self.drawFrame(lightScreen, backdrop, smokeScreen)
+        self.frameVersions = versions
+        self.drawCounts["frame"] += 1
+        return self.frame
+
+    def drawFrame(self, lightScreen, backdrop, smokeScreen = None):
+        if self.compositeMode == "float32":
+            return self.combineScreensInPlace(lightScreen, backdrop, smokeScreen)
+        if self.compositeMode == "tiled":
+            return self.combineScreensTiled(lightScreen, backdrop, smokeScreen)
         
         #Smokescreen is gotten and converted to have same shape as color
-        smokeScreen = self.smoke.getSmokeScreen()
+        if smokeScreen is None:
+            smokeScreen = self.getSmokeScreen()
         smokeScreen = np.stack([smokeScreen, smokeScreen, smokeScreen], -1)
         
         #Smokescreen is combined with lightscreen to produce a screen with the light on the smoke
         litSmokeScreen = smokeScreen * lightScreen
 
-        #Backdrop is gotten then objects overlayed
-        backdrop = self.background.getBackground()
-        backdrop = np.fliplr(backdrop)
-
-        for object in self.objectList:
-            object.update(dt)
-            objectScreen = object.getObjectScreen()
-            alphaMask = objectScreen[:, :, 3]
-            alphaMask = np.stack([alphaMask, alphaMask, alphaMask], -1)
-            objectScreen = objectScreen[:, :, :3]
-            backdrop = alphaMask * objectScreen + (1.0 - alphaMask) * backdrop
-
         #Backdrop is combined with light not absorbed by smoke to produce a screen with light on the backdrop and objects
         litBackdrop = lightScreen * backdrop * (1 - smokeScreen)
 
@@ -610,4 +1870,87 @@ class Scene:
         output = np.swapaxes(output, 0, 1)
 
         return output
+
+    #Combine the screens using only the scene's own float32 buffers
+    #The returned frame is a view of the output buffer, so it is overwritten by the next frame
+    def combineScreensInPlace(self, lightScreen, backdrop, smokeScreen = None):
+        #Smoke has a single channel, it is broadcast across the colors instead of being stacked
+        if smokeScreen is None:
+            smokeScreen = self.getSmokeScreen(self.smokeBuffer)
+        smokeScreen = smokeScreen[:, :, np.newaxis]
+
+        #light * (smoke + backdrop * (1 - smoke)) is the same as lit smoke plus light on the backdrop not absorbed by smoke
+        output = self.outputBuffer
+        np.subtract(1, backdrop, out=output)
+        output *= smokeScreen
+        output += backdrop
+        output *= lightScreen
+
+        #Only search for the brightest pixel if the lights are bright enough to go over 1
+        if self.getMaxBrightness() > 1:
+            output /= max(1, output.max())
+
+        #Re-orient to work with matplotlib
+        return np.swapaxes(output, 0, 1)
+
+    #Tiles of the screen any light cone reaches, worked out from the edges of the cones rather than by looking at the light screen
+    #Lights drawn one at a time use cones from the cone cache, so their edges are found from the same rounded values
+    def getLitTiles(self):
+        lights = [light for light in self.lightList if np.any(light.getColor() != 0)]
+        if len(lights) == 0:
+            return np.zeros([self.tiledCompositor.tileColumns, self.tiledCompositor.tileRows], bool)
+
+        if self.batchLights:
+            coneParameters = [(light.getHorizontalPosition(), light.direction, light.spreadAngle, light.getWidth()) for light in lights]
+        else:
+            coneParameters = [light.getConeParameters() for light in lights]
+        xPositions, directions, spreadAngles, widths = np.array(coneParameters, float).T
+        leftEdges, rightEdges = self.lightRasterizer.getConeEdges(xPositions, directions, spreadAngles, widths)
+        return self.tiledCompositor.getLitTiles(leftEdges, rightEdges)
+
+    #Combine the screens in the scene's own float32 buffers, skipping tiles no light reaches
+    def combineScreensTiled(self, lightScreen, backdrop, smokeScreen = None):
+        if smokeScreen is None:
+            getSmokeScreen = lambda: self.getSmokeScreen(self.smokeBuffer)
+        else:
+            getSmokeScreen = lambda: smokeScreen
+
+        output = self.tiledCompositor.composite(lightScreen, backdrop, getSmokeScreen, self.outputBuffer, self.getLitTiles(), self.getMaxBrightness() > 1)
+
+        #Re-orient to work with matplotlib
+        return np.swapaxes(output, 0, 1)
+
+    #How many times each layer was reused and drawn, reused layers cost next to nothing
+    def getReuseStats(self):
+        stats = {}
+        for layerName in reuseLayerNames:
+            reused = self.reuseCounts[layerName]
+            drawn = self.drawCounts[layerName]
+            stats[layerName + "Reused"] = reused
+            stats[layerName + "Drawn"] = drawn
+            stats[layerName + "ReusedFraction"] = reused / (reused + drawn) if reused + drawn > 0 else 0.0
+        return stats
+
+    #Returns everything needed to put the stage back in its current state, including the random number generator
+    #Snapshots only hold arrays, numbers and lists so they can be pickled and sent to other processes
+    def getSnapshot(self):
+        if self.pipeline != None:
+            self.pipeline.wait()
+        return {
+            "randomState" : np.random.get_state(),
+            "smoke" : self.smoke.getSnapshot(),
+            "lights" : [light.getSnapshot() for light in self.lightList],
+            "objects" : [object.getSnapshot() for object in self.objectList]
+        }
+
+    #Restore a snapshot taken from this stage, or another stage loaded from the same choreography
+    def setSnapshot(self, snapshot):
+        if self.pipeline != None:
+            self.pipeline.reset()
+        np.random.set_state(snapshot["randomState"])
+        self.smoke.setSnapshot(snapshot["smoke"])
+        for light, lightSnapshot in zip(self.lightList, snapshot["lights"]):
+            light.setSnapshot(lightSnapshot)
+        for object, objectSnapshot in zip(self.objectList, snapshot["objects"]):
+            object.setSnapshot(objectSnapshot)
     
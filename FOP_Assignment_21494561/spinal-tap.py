@@ -1,124 +1,172 @@
-import matplotlib.pyplot as plt
+import argparse
 import sceneElements as SE
-import time
-import pandas
-
-#Create custom errors for loading choreography
-class failedStageInit(Exception):
-    pass
-class missingValue(Exception):
-    def __init__(self, type, rowIndex):
-        print("Recquired value is missing from input file for " + type + " in row " + str(2 + rowIndex))
-
-choreogrpahyLocation = "Choreography.xlsx"
-
-try:
-    #Load the choreography file and get the initialisation sheet
-    choreogrpahy = pandas.read_excel(choreogrpahyLocation, None)
-    init = choreogrpahy['init']
-
-    #Check recquired values are present then initialise stage
-    if init.get("Type").get(1) != "Stage":
-        raise failedStageInit
+import stageLoader
+
+#Stage settings given on the command line, these replace the ones in the init sheet
+def getSceneOptions(arguments):
+    sceneOptions = {}
+    if arguments.composite != None:
+        sceneOptions["compositeMode"] = arguments.composite
+    if arguments.batch_lights != None:
+        sceneOptions["batchLights"] = arguments.batch_lights
+    if arguments.tile_size != None:
+        sceneOptions["tileSize"] = arguments.tile_size
+    if arguments.tile_workers != None:
+        sceneOptions["tileWorkers"] = arguments.tile_workers
+    if arguments.particle_capacity != None:
+        sceneOptions["particleCapacity"] = arguments.particle_capacity
+    if arguments.overflow_policy != None:
+        sceneOptions["overflowPolicy"] = arguments.overflow_policy
+    return sceneOptions
+
+#Stage settings that change how the show is simulated, saved checkpoints made with different ones are not used
+simulationOptions = ["particleCapacity", "overflowPolicy"]
+
+#Give the stage a profiler if any profiling was asked for
+def startProfiler(stage, arguments):
+    if not (arguments.profile or arguments.profile_output != None or arguments.trace != None):
+        return None
+
+    import frameProfiler
+    profiler = frameProfiler.FrameProfiler(capacity = 100000, traceMemory = arguments.trace_memory)
+    stage.setProfiler(profiler)
+    return profiler
+
+def saveProfile(profiler, arguments):
+    if profiler == None:
+        return
+    if arguments.profile_output != None:
+        if arguments.profile_output.lower().endswith(".csv"):
+            profiler.saveCsv(arguments.profile_output)
+        else:
+            profiler.saveJson(arguments.profile_output)
+    if arguments.trace != None:
+        profiler.saveTrace(arguments.trace)
+
+#Draw frames on several threads if --pipeline was given
+def startPipeline(stage, arguments):
+    if arguments.pipeline <= 0:
+        return
+    import renderPipeline
+    stage.setPipeline(renderPipeline.RenderPipeline(stage, arguments.pipeline))
+
+def stopPipeline(stage):
+    if stage.pipeline != None:
+        print(stage.pipeline.getSummaryText())
+        stage.setPipeline(None)
+
+#Move the stage to the --start time before it is shown, using checkpoints so later seeks and runs don't simulate the whole show again
+def seekStart(stage, choreogrpahyLocation, arguments):
+    if arguments.start <= 0 and arguments.checkpoints == None:
+        return None
+
+    import checkpoints
+    key = stageLoader.getFileHash(choreogrpahyLocation)
+    sceneOptions = getSceneOptions(arguments)
+    for optionName in simulationOptions:
+        if optionName in sceneOptions:
+            key += "-" + optionName + "=" + str(sceneOptions[optionName])
+    store = checkpoints.CheckpointStore(stage, arguments.fps, arguments.checkpoint_interval, arguments.checkpoints, key)
+    store.seek(arguments.start)
+    stats = store.getStats()
+    print("Started at " + str(arguments.start) + "s from the checkpoint at " + ("%.1f" % (stats["lastSeek"]["checkpointFrame"] / arguments.fps)) + "s in " + ("%.2f" % stats["lastSeek"]["time"]) + "s, " + str(stats["checkpoints"]) + " checkpoints")
+    return store
+
+#Processes started by the parallel renderer import this file, so the show is only run when it is the main program
+def main():
+    parser = argparse.ArgumentParser(description="Render a stage show from a choreography file")
+    parser.add_argument("choreography", nargs="?", default="Choreography.xlsx", help="Choreography excel file to load")
+    parser.add_argument("--headless", metavar="OUTPUT", help="Render without a window to a video file, or an image sequence such as frames/%%05d.png")
+    parser.add_argument("--fps", type=float, default=30, help="Frames per second of the headless render")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of the show to render headless")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes to split a headless render across")
+    parser.add_argument("--queue", type=int, default=2, help="Number of finished frames that can wait for the display before the oldest is dropped")
+    parser.add_argument("--stream-shm", metavar="NAME", help="Stream frames in real time to a shared memory ring that other processes can read with frameStream.SharedFrameReader")
+    parser.add_argument("--stream-pipe", metavar="OUTPUT", help="Stream raw rgb24 frames in real time to a named pipe, or - for stdout")
+    parser.add_argument("--stream-slots", type=int, default=4, help="Number of frames kept in the shared memory ring")
+    parser.add_argument("--pipeline", metavar="THREADS", type=int, default=0, help="Work out the smoke, lights and objects of each frame at the same time on this many threads, starting the next frame's smoke while a frame is shown")
+    parser.add_argument("--start", type=float, default=0, help="Seconds into the show to start from")
+    parser.add_argument("--checkpoints", metavar="DIRECTORY", help="Save checkpoints of the show here, so later runs can start anywhere without simulating everything before it")
+    parser.add_argument("--checkpoint-interval", type=float, default=5, help="Seconds of the show between checkpoints")
+    parser.add_argument("--no-cache", action="store_true", help="Always read the excel workbook instead of the cached choreography saved next to it")
+    parser.add_argument("--composite", choices=["float64", "float32", "tiled"], help="How the light, smoke and backdrop are combined into each frame, replacing the composite mode in the init sheet")
+    parser.add_argument("--batch-lights", action="store_true", default=None, help="Draw every light at once, which is faster for large rigs, instead of what the init sheet says")
+    parser.add_argument("--tile-size", type=int, help="Size of the tiles in the tiled composite mode, replacing the one in the init sheet")
+    parser.add_argument("--tile-workers", type=int, help="Threads the tiled composite mode shares lit tiles between, replacing the number in the init sheet")
+    parser.add_argument("--particle-capacity", type=int, help="Most smoke particles kept at once, replacing the number in the init sheet")
+    parser.add_argument("--overflow-policy", choices=["drop oldest", "refuse"], help="Whether new smoke particles replace the oldest or are refused once there are --particle-capacity of them")
+    parser.add_argument("--profile", action="store_true", help="Show the frame rate and time taken by each part of the frame over the stage")
+    parser.add_argument("--profile-output", metavar="OUTPUT", help="Save the time taken by each part of every frame to a .csv or .json file")
+    parser.add_argument("--trace", metavar="OUTPUT", help="Save a Chrome trace of every frame that can be opened in chrome://tracing or Perfetto")
+    parser.add_argument("--trace-memory", action="store_true", help="Also record memory allocated each frame when profiling, this slows the show down")
+    arguments = parser.parse_args()
+
+    choreogrpahyLocation = arguments.choreography
+    sceneOptions = getSceneOptions(arguments)
+
+    try:
+        if arguments.headless != None and arguments.workers > 1:
+            if arguments.start > 0:
+                print("--start is not used when rendering with more than one worker")
+            #Split the show into chunks rendered by separate processes
+            import parallelRender
+            parallelRender.renderParallel(choreogrpahyLocation, arguments.headless, arguments.fps, arguments.duration, arguments.workers, useCache = not arguments.no_cache, sceneOptions = sceneOptions)
+
+        elif arguments.headless != None:
+            #Render straight to a file at a fixed timestep, without matplotlib
+            import offlineRender
+            stage = stageLoader.loadStage(choreogrpahyLocation, not arguments.no_cache, sceneOptions)
+            store = seekStart(stage, choreogrpahyLocation, arguments)
+            profiler = startProfiler(stage, arguments)
+            startPipeline(stage, arguments)
+            try:
+                offlineRender.renderOffline(stage, arguments.headless, arguments.fps, arguments.duration, store != None)
+            finally:
+                stopPipeline(stage)
+                saveProfile(profiler, arguments)
     
-    isNull = init.loc[1].isna().to_list()
-    if True in isNull[1:4]:
-        raise missingValue("stage", 1)
-    
-    horizontalSize = init.get('a').get(1)
-    verticalSize = init.get('b').get(1)
-    baseSmoke = init.get('c').get(1)
-
-    stage = SE.Scene(horizontalSize, verticalSize, baseSmoke)
-    
-    if isNull[4] == False:
-        stage.setBackground(init.get('d').get(1))
-
-
-
-    #Go through each row in initialisation sheet and create all the recquired objects, checking recquired values are present
-    for rowIndex in range(0, len(init.index)):
-        row = init.iloc[rowIndex]
-
-        #Create Lights
-        if row.get("Type") == "Light":
-            rowNulls = row.isna().to_list()
-            if True in rowNulls[1:]:
-                raise missingValue("light", rowIndex)
-            
-            horizontalPosition = row.get('b')
-            direction = row.get('c')
-            strength = row.get('d')
-            spreadAngle = row.get('e')
-            width = row.get('f')
-            color = row.get('g')
-            
-            instructionSet = choreogrpahy[row.get('a')]
-            stage.addLight(horizontalPosition, direction, strength, spreadAngle, width, color, instructionSet)
-        
-        #Create Smoke Machines
-        elif row.get("Type") == "Smoke Machine":
-            rowNulls = row.isna().to_list()
-            if True in rowNulls[1:6]:
-                raise missingValue("smokeMachine", rowIndex)
-            
-            position = [row.get('b'), row.get('c')]
-            strength = row.get('d')
-            direction = row.get('e')
-            speed = row.get('f')
-            
-            instructionSet = choreogrpahy[row.get('a')]
-            stage.addSmokeMachine(position, strength, direction, speed, instructionSet)
-        
-        #Create objects(images on the stage)
-        elif row.get("Type") == "Object":
-            rowNulls = row.isna().to_list()
-            if True in rowNulls[1:6]:
-                raise missingValue("smokeMachine", rowIndex)
-            
-            imageLocation = row.get('b')
-            position = [row.get('c'), row.get('d')]
-            horizontalSize = row.get('e')
-            rotation = row.get('f')
-            
-            instructionSet = choreogrpahy[row.get('a')]
-            stage.addObject(imageLocation, rotation, position, horizontalSize, instructionSet)
-    
-    
-    #Setup rendering loop and render first frame
-    dt = 0
-    fig, axs = plt.subplots(nrows = 2, ncols = 1, figsize = (6, 6), gridspec_kw={'height_ratios': [1, 6]})
-    axs[1] = plt.imshow(stage.render(0), origin='lower')
-    plt.draw()
-    plt.pause(0.0001)
-
-    #Main render Loop
-    for i in range(10000):
-        startTime = time.monotonic()
-
-        axs[1].set_data(stage.render(dt))
-
-        #Setup light plot
-        axs[0].cla()
-        axs[0].set_xlim([0, 512])
-        axs[0].set_ylim([0, 32])
-        axs[0].set_facecolor('k')
-        axs[0].add_collection(stage.getLightPatchCollection())
-        
-        plt.draw()
-        plt.pause(0.0001)
-
-        lastTime = time.monotonic()
-        dt =  lastTime - startTime
-        # print("FPS: " + str(1 / dt))
-
-
-except failedStageInit:
-    print("Stage init failed")
-except missingValue:
-    pass
-except FileNotFoundError:
-    print("Choreography file was not found")
-except SE.end:
-    pass
-
+        elif arguments.stream_shm != None or arguments.stream_pipe != None:
+            #Send frames to other programs instead of a window
+            import frameStream
+            stage = stageLoader.loadStage(choreogrpahyLocation, not arguments.no_cache, sceneOptions)
+            outputs = []
+            if arguments.stream_shm != None:
+                outputs.append(frameStream.SharedFrameRing(arguments.stream_shm, stage.horizontalSize, stage.verticalSize, arguments.stream_slots))
+            if arguments.stream_pipe != None:
+                outputs.append(frameStream.FramePipeWriter(arguments.stream_pipe, stage.horizontalSize, stage.verticalSize, arguments.queue))
+            store = seekStart(stage, choreogrpahyLocation, arguments)
+            profiler = startProfiler(stage, arguments)
+            startPipeline(stage, arguments)
+            try:
+                frameStream.streamFrames(stage, outputs, arguments.fps, arguments.duration, store != None)
+            finally:
+                stopPipeline(stage)
+                saveProfile(profiler, arguments)
+
+        else:
+            #Simulate on a separate thread so slow drawing doesn't slow the show down
+            import liveRender
+            stage = stageLoader.loadStage(choreogrpahyLocation, not arguments.no_cache, sceneOptions)
+            store = seekStart(stage, choreogrpahyLocation, arguments)
+            profiler = startProfiler(stage, arguments)
+            startPipeline(stage, arguments)
+            try:
+                liveRender.renderLive(stage, queueSize = arguments.queue, started = store != None)
+            finally:
+                stopPipeline(stage)
+                saveProfile(profiler, arguments)
+
+    except stageLoader.failedStageInit:
+        print("Stage init failed")
+    except ValueError as error:
+        print("Stage init failed: " + str(error))
+    except stageLoader.missingValue:
+        pass
+    except FileNotFoundError:
+        print("Choreography file was not found")
+    except SE.end:
+        pass
+
+
+if __name__ == "__main__":
+    main()
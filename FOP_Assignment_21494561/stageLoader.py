@@ -0,0 +1,256 @@
+import hashlib
+import json
+import math
+import os
+import zipfile
+import numpy as np
+import sceneElements as SE
+
+#Changed whenever the layout of the cache changes so old caches are read again from the workbook
+cacheVersion = 7
+
+#Create custom errors for loading choreography
+class failedStageInit(Exception):
+    pass
+class missingValue(Exception):
+    def __init__(self, type, rowIndex):
+        print("Recquired value is missing from input file for " + type + " in row " + str(2 + rowIndex))
+
+#Turn a value read by pandas into a plain python value, blanks become None
+def getPlainValue(value):
+    if SE.isBlank(value) or (isinstance(value, np.floating) and np.isnan(value)):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+#Read a choreography workbook and check it, returning the stage, every element and the instruction sheets they use as plain python values
+#pandas is only imported here, so nothing else has to wait for it when the workbook is already cached
+def readChoreography(choreogrpahyLocation):
+    import pandas
+
+    #Load the choreography file and get the initialisation sheet
+    choreogrpahy = pandas.read_excel(choreogrpahyLocation, None)
+    init = choreogrpahy['init']
+
+    #Check recquired values are present then initialise stage
+    if init.get("Type").get(1) != "Stage":
+        raise failedStageInit
+
+    isNull = init.loc[1].isna().to_list()
+    if True in isNull[1:4]:
+        raise missingValue("stage", 1)
+
+    stage = {
+        "horizontalSize" : getPlainValue(init.get('a').get(1)),
+        "verticalSize" : getPlainValue(init.get('b').get(1)),
+        "baseSmoke" : getPlainValue(init.get('c').get(1)),
+        "background" : None,
+        "smokeEngine" : "particle",
+        "smokeScale" : 1,
+        "flowPeriod" : None,
+        "compositeMode" : "float64",
+        "batchLights" : False,
+        "tileSize" : 32,
+        "tileWorkers" : 1,
+        "particleCapacity" : 200000,
+        "overflowPolicy" : "drop oldest"
+    }
+
+    if isNull[4] == False:
+        stage["background"] = getPlainValue(init.get('d').get(1))
+
+    #Optional smoke engine, either particle or grid
+    if len(isNull) > 5 and isNull[5] == False:
+        stage["smokeEngine"] = getPlainValue(init.get('e').get(1))
+
+    #Optional smoke scale, how many times smaller than the stage the smoke is simulated
+    if len(isNull) > 6 and isNull[6] == False:
+        stage["smokeScale"] = getPlainValue(init.get('f').get(1))
+
+    #Optional flow period, the smoke follows a flow that changes over time and repeats after this many seconds
+    if len(isNull) > 7 and isNull[7] == False:
+        stage["flowPeriod"] = getPlainValue(init.get('g').get(1))
+
+    #Optional composite mode, float64, float32 or tiled, in the column after the flow period
+    #Columns past g have no heading, so they are read by position
+    if len(isNull) > 8 and isNull[8] == False:
+        stage["compositeMode"] = getPlainValue(init.iloc[1, 8])
+
+    #Optional batch lights, TRUE or yes draws every light at once, which is faster for large rigs
+    if len(isNull) > 9 and isNull[9] == False:
+        stage["batchLights"] = str(getPlainValue(init.iloc[1, 9])).lower() in ["true", "yes", "1", "1.0"]
+
+    #Optional tile size and number of threads for the tiled composite mode
+    if len(isNull) > 10 and isNull[10] == False:
+        stage["tileSize"] = getPlainValue(init.iloc[1, 10])
+    if len(isNull) > 11 and isNull[11] == False:
+        stage["tileWorkers"] = getPlainValue(init.iloc[1, 11])
+
+    #Optional most smoke particles kept at once, and whether new particles "drop oldest" or "refuse" once there are that many
+    if len(isNull) > 12 and isNull[12] == False:
+        stage["particleCapacity"] = getPlainValue(init.iloc[1, 12])
+    if len(isNull) > 13 and isNull[13] == False:
+        stage["overflowPolicy"] = getPlainValue(init.iloc[1, 13])
+
+    #Go through each row in initialisation sheet and find all the recquired objects, checking recquired values are present
+    elements = []
+    for rowIndex in range(0, len(init.index)):
+        row = init.iloc[rowIndex]
+        rowNulls = row.isna().to_list()
+
+        #Lights
+        if row.get("Type") == "Light":
+            if True in rowNulls[1:8]:
+                raise missingValue("light", rowIndex)
+            values = [row.get('b'), row.get('c'), row.get('d'), row.get('e'), row.get('f'), row.get('g')]
+
+        #Smoke Machines
+        elif row.get("Type") == "Smoke Machine":
+            if True in rowNulls[1:6]:
+                raise missingValue("smokeMachine", rowIndex)
+            values = [[row.get('b'), row.get('c')], row.get('d'), row.get('e'), row.get('f')]
+
+        #Objects(images on the stage)
+        elif row.get("Type") == "Object":
+            if True in rowNulls[1:6]:
+                raise missingValue("smokeMachine", rowIndex)
+            values = [row.get('b'), row.get('f'), [row.get('c'), row.get('d')], row.get('e')]
+
+        else:
+            continue
+
+        values = [[getPlainValue(value) for value in item] if isinstance(item, list) else getPlainValue(item) for item in values]
+        elements.append({"type" : row.get("Type"), "sheet" : getPlainValue(row.get('a')), "values" : values})
+
+    #Keep the instruction sheets as columns of values
+    sheets = {}
+    for element in elements:
+        sheet = choreogrpahy[element["sheet"]]
+        sheets[element["sheet"]] = {str(columnName) : [getPlainValue(value) for value in sheet[columnName]] for columnName in sheet.columns}
+
+    return {"stage" : stage, "elements" : elements, "sheets" : sheets}
+
+#Create the stage with every light, smoke machine and object in a choreography from readChoreography
+#Flow volumes are saved in cacheDirectory so they are only made once
+#sceneOptions replace stage values from the init sheet, eg {"compositeMode" : "tiled"} from the command line
+def buildStage(choreography, cacheDirectory = None, sceneOptions = None):
+    stageValues = dict(choreography["stage"])
+    if sceneOptions != None:
+        stageValues.update(sceneOptions)
+    stage = SE.Scene(stageValues["horizontalSize"], stageValues["verticalSize"], stageValues["baseSmoke"], stageValues["smokeEngine"], stageValues["batchLights"], stageValues["compositeMode"], stageValues["smokeScale"], int(stageValues["tileSize"]), int(stageValues["tileWorkers"]), int(stageValues["particleCapacity"]), stageValues["overflowPolicy"])
+
+    if stageValues["flowPeriod"] != None:
+        stage.setFlowVolume(SE.FlowVolume(stageValues["horizontalSize"], stageValues["verticalSize"], stageValues["flowPeriod"], cacheDirectory = cacheDirectory))
+
+    if stageValues["background"] != None:
+        stage.setBackground(stageValues["background"])
+
+    for element in choreography["elements"]:
+        instructionSet = choreography["sheets"][element["sheet"]]
+        if element["type"] == "Light":
+            horizontalPosition, direction, strength, spreadAngle, width, color = element["values"]
+            stage.addLight(horizontalPosition, direction, strength, spreadAngle, width, color, instructionSet)
+        elif element["type"] == "Smoke Machine":
+            position, strength, direction, speed = element["values"]
+            stage.addSmokeMachine(position, strength, direction, speed, instructionSet)
+        elif element["type"] == "Object":
+            imageLocation, rotation, position, horizontalSize = element["values"]
+            stage.addObject(imageLocation, rotation, position, horizontalSize, instructionSet)
+
+    #Prepare the angles and scales in the object sheets, otherwise every object would be drawn at 0 degrees and scale 1
+    stage.prepareObjectTransforms()
+
+    return stage
+
+def getCacheLocation(choreogrpahyLocation):
+    return choreogrpahyLocation + ".cache.npz"
+
+def getFileHash(fileLocation):
+    with open(fileLocation, "rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+#Save a checked choreography next to its workbook
+#Columns that are all numbers are stored as arrays, everything else is small enough to go in the json description
+def saveChoreographyCache(choreogrpahyLocation, choreography):
+    fileStats = os.stat(choreogrpahyLocation)
+    description = {
+        "version" : cacheVersion,
+        "source" : {"size" : fileStats.st_size, "modified" : fileStats.st_mtime_ns, "hash" : getFileHash(choreogrpahyLocation)},
+        "stage" : choreography["stage"],
+        "elements" : choreography["elements"],
+        "sheets" : {}
+    }
+    arrays = {}
+
+    for sheetName, sheet in choreography["sheets"].items():
+        columns = {}
+        for columnName, values in sheet.items():
+            if all(value == None or (isinstance(value, (int, float)) and not isinstance(value, bool)) for value in values):
+                arrayName = "column" + str(len(arrays))
+                arrays[arrayName] = np.array([math.nan if value == None else value for value in values], float)
+                columns[columnName] = {"array" : arrayName}
+            else:
+                columns[columnName] = {"values" : values}
+        description["sheets"][sheetName] = columns
+    arrays["description"] = np.array(json.dumps(description))
+
+    #Written to a temporary file first so a process reading the cache never sees half of it
+    cacheLocation = getCacheLocation(choreogrpahyLocation)
+    temporaryLocation = cacheLocation + "." + str(os.getpid()) + ".tmp"
+    try:
+        with open(temporaryLocation, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(temporaryLocation, cacheLocation)
+    except OSError:
+        print("Could not save choreography cache " + cacheLocation)
+
+#Load a choreography saved by saveChoreographyCache, or None if there is no cache or the workbook has changed since it was saved
+#The file size and modified time are checked first, the workbook is only hashed if they are different
+def loadChoreographyCache(choreogrpahyLocation):
+    fileStats = os.stat(choreogrpahyLocation)
+    cacheLocation = getCacheLocation(choreogrpahyLocation)
+    if not os.path.isfile(cacheLocation):
+        return None
+
+    try:
+        with np.load(cacheLocation) as cache:
+            description = json.loads(str(cache["description"]))
+            if description["version"] != cacheVersion:
+                return None
+
+            source = description["source"]
+            if source["size"] != fileStats.st_size or source["modified"] != fileStats.st_mtime_ns:
+                if source["size"] != fileStats.st_size or source["hash"] != getFileHash(choreogrpahyLocation):
+                    return None
+
+            sheets = {}
+            for sheetName, columns in description["sheets"].items():
+                sheets[sheetName] = {}
+                for columnName, column in columns.items():
+                    if "array" in column:
+                        sheets[sheetName][columnName] = cache[column["array"]]
+                    else:
+                        sheets[sheetName][columnName] = column["values"]
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        print("Choreography cache " + cacheLocation + " is invalid, reading workbook")
+        return None
+
+    return {"stage" : description["stage"], "elements" : description["elements"], "sheets" : sheets}
+
+#Load a choreography file and create the stage with every light, smoke machine and object in it
+#The checked choreography is cached next to the workbook, so later loads skip reading the excel file until it changes
+def loadStage(choreogrpahyLocation, useCache = True, sceneOptions = None):
+    choreography = None
+    if useCache:
+        choreography = loadChoreographyCache(choreogrpahyLocation)
+
+    if choreography == None:
+        choreography = readChoreography(choreogrpahyLocation)
+        if useCache:
+            saveChoreographyCache(choreogrpahyLocation, choreography)
+
+    cacheDirectory = None
+    if useCache:
+        cacheDirectory = os.path.dirname(os.path.abspath(choreogrpahyLocation))
+    return buildStage(choreography, cacheDirectory, sceneOptions)
@@ -0,0 +1,50 @@
+import os
+import numpy as np
+import sceneElements as SE
+
+guitarLocation = os.path.join(os.path.dirname(os.path.abspath(__file__)), "guitar.png")
+
+#Centre of the pixels an object covers, weighted by how opaque they are
+def getCentroid(stageObject):
+    screen = np.ones([stageObject.screenHorizontalSize, stageObject.screenVerticalSize, 3], np.float32)
+    stageObject.blitToScreen(screen)
+    background = np.zeros_like(screen)
+    stageObject.blitToScreen(background)
+    coverage = 1 - (screen - background)[:, :, 0]
+    rows, columns = np.indices(coverage.shape)
+    return np.array([(rows * coverage).sum(), (columns * coverage).sum()]) / coverage.sum()
+
+def test_objectTurnsAndScalesAboutItsCentre():
+    spriteCache = SE.Object.spriteCache
+    SE.Object.spriteCache = SE.SpriteCache(variantAngles = [0.0, 45.0, 90.0], variantScales = [1.0, 2.0])
+    try:
+        stageObject = SE.Object(guitarLocation, 1, [250, 200], 60, None, 600, 600)
+        centroid = getCentroid(stageObject)
+        for angle, scale in [(45.0, 1.0), (90.0, 1.0), (0.0, 2.0), (45.0, 2.0)]:
+            stageObject.setTransform(angle, scale)
+            assert np.abs(getCentroid(stageObject) - centroid).max() < 1.0, (angle, scale)
+    finally:
+        SE.Object.spriteCache = spriteCache
+
+def test_objectTransformsInSheetArePrepared():
+    spriteCache = SE.Object.spriteCache
+    SE.Object.spriteCache = SE.SpriteCache()
+    try:
+        stage = SE.Scene(400, 300, 0.1)
+        instructionSet = {"Instruction" : ["Move To", "Move To"], "End Time" : [2, 4], "Angle" : [100, -30], "Scale" : [2, 0.5]}
+        stage.addObject(guitarLocation, 0, [100, 100], 60, instructionSet)
+        stage.prepareObjectTransforms()
+        for angle in [100.0, 330.0, 45.0]:
+            assert angle in SE.Object.spriteCache.variantAngles
+        for scale in [0.5, 1.25, 2.0]:
+            assert scale in SE.Object.spriteCache.variantScales
+    finally:
+        SE.Object.spriteCache = spriteCache
+
+def test_flowPeriodMustBePositive():
+    for period in [0, -5]:
+        try:
+            SE.FlowVolume(64, 64, period)
+        except ValueError:
+            continue
+        assert False, period